@@ -0,0 +1,341 @@
+import sys
+import os
+import getopt
+import time
+import json
+import math
+import random
+import resource
+import platform
+import itertools
+import subprocess
+import tempfile
+import multiprocessing
+import tracemalloc
+
+from handler import Tree, EclatMiner, treeNode, loadData, read_batches, countSink
+
+class dictNode (object):
+    """
+    Node with a per-instance __dict__ and a children list, the layout
+    treeNode had before it used __slots__.
+    """
+    def __init__(self, name, support, parentNode):
+        self.name = name
+        self.support = support
+        self.batch = 0
+        self.link = None
+        self.parent = parentNode
+        self.children = []
+
+def copy_tree(root, legacy):
+    """
+    Copy the shape, names and supports of a tree into new nodes, either
+    dictNode objects or treeNode ones.
+    """
+    if legacy:
+        copy = dictNode(root.name, root.support, None)
+    else:
+        copy = treeNode(root.name, root.support, None)
+    count = 0
+    stack = [(root, copy)]
+    while len(stack):
+        node, parent = stack.pop()
+        for child in node.child_nodes():
+            if legacy:
+                new = dictNode(child.name, child.support, parent)
+                parent.children.append(new)
+            else:
+                new = parent.add_child(child.name)
+                new.support = child.support
+            new.batch = child.batch
+            count += 1
+            stack.append((child, new))
+    return copy, count
+
+def node_memory(tree):
+    """
+    Measure the bytes per node of copies of the tree made of dictNode and
+    of treeNode objects.
+    """
+    result = {}
+    for key, legacy in (('dict_bytes_per_node', True), ('slots_bytes_per_node', False)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        copy, count = copy_tree(tree.root, legacy)
+        result[key] = (tracemalloc.get_traced_memory()[0] - before) / count
+        result['nodes'] = count
+        del copy
+        tracemalloc.stop()
+    return result
+
+def topk_benchmark(tree, ks):
+    """
+    Time mine_topk against thresholded mining at the support of the k-th
+    itemset, the cutoff that yields the same itemsets.
+    """
+    result = []
+    for k in ks:
+        start = time.time()
+        top = tree.mine_topk(k)
+        topkTime = time.time() - start
+        cutoff = top[-1][1] if len(top) else 0
+        start = time.time()
+        count = sum(len(frequent) for frequent in tree.mine_itemsets(cutoff, False))
+        thresholdTime = time.time() - start
+        result.append({'k': k, 'cutoff': cutoff, 'itemsets': count,
+                       'topk_seconds': topkTime, 'threshold_seconds': thresholdTime})
+    return result
+
+def backend_benchmark(test, batchSize, preMinSup, minSup, minWeight=0):
+    """
+    Insert the same batches into a canonical Tree and an EclatMiner and
+    time the insertion and the mining of both.
+    """
+    result = {}
+    for name, miner in (('tree', Tree([], 1, 0.6, 'None', 0, True)), ('vertical', EclatMiner(0.6, minWeight))):
+        start = time.time()
+        for index in range(0, len(test), batchSize):
+            miner.insert_transactions(test[index:index + batchSize], preMinSup * batchSize)
+        insertTime = time.time() - start
+        start = time.time()
+        count = miner.mine_to(countSink(), minSup * batchSize, True).count
+        result[name] = {'insert_seconds': insertTime, 'mine_seconds': time.time() - start, 'itemsets': count}
+    return result
+
+def poisson(rnd, mean):
+    """
+    Poisson sample by multiplying uniforms, for the small means of the
+    generator.
+    """
+    limit = math.exp(-mean)
+    count = 0
+    product = rnd.random()
+    while product > limit:
+        count += 1
+        product *= rnd.random()
+    return count
+
+def generate_quest(path, D, T=10, I=4, N=1000, L=2000, seed=0, correlation=0.5, corruption=0.5):
+    """
+    Write D transactions in the 'id len tid items...' format of the IBM
+    Quest generator, built the same way: L potentially frequent itemsets
+    of Poisson(I) items, each sharing an exponential fraction (mean
+    correlation) of its items with the previous one, picked with
+    exponential weights; a transaction of Poisson(T) items is filled with
+    such itemsets, each corrupted by dropping items while a uniform draw
+    stays below its corruption level.
+    """
+    rnd = random.Random(seed)
+    patterns = []
+    for index in range(L):
+        size = max(1, poisson(rnd, I))
+        items = []
+        if len(patterns):
+            shared = min(size, int(size * min(1, rnd.expovariate(1 / correlation))))
+            previous = patterns[-1][0]
+            items = rnd.sample(previous, min(shared, len(previous)))
+        while len(items) < size:
+            item = rnd.randrange(N)
+            if item not in items:
+                items.append(item)
+        patterns.append((items, min(1, max(0, rnd.gauss(corruption, 0.1)))))
+    weights = list(itertools.accumulate(rnd.expovariate(1) for _ in range(L)))
+    with open(path, 'w') as output:
+        for tid in range(1, D + 1):
+            size = max(1, poisson(rnd, T))
+            transaction = []
+            while len(transaction) < size:
+                items, level = patterns[rnd.choices(range(L), cum_weights=weights)[0]]
+                items = list(items)
+                while len(items) and rnd.random() < level:
+                    items.pop(rnd.randrange(len(items)))
+                for item in items:
+                    if item not in transaction:
+                        transaction.append(item)
+            transaction = sorted(transaction[:max(size, 1)])
+            output.write("{} {} {} {}\n".format(tid, len(transaction), tid, " ".join(map(str, transaction))))
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def run_case(database, sampleSize, batchSize, preMinSup, fading, minSups, modes, canonical):
+    """
+    Stream the database into a tree and mine it at every minimum support
+    in every mode.  Runs in its own process so the peak RSS is its own.
+    """
+    baseline = peak_rss()
+    tree = Tree([], 1, fading, 'None', 0, canonical)
+    transactions = 0
+    start = time.time()
+    for batch in read_batches(database, batchSize, sampleSize):
+        tree.insert_transactions(batch, preMinSup * batchSize)
+        transactions += len(batch)
+    elapsed = time.time() - start
+    result = {'batch_size': batchSize, 'pre_min_sup': preMinSup, 'fading': fading,
+              'canonical': canonical, 'transactions': transactions,
+              'insert_seconds': elapsed, 'transactions_per_second': transactions / elapsed if elapsed else None,
+              'nodes': tree.nodes, 'mining': []}
+    for minSup in minSups:
+        for mode in modes:
+            start = time.time()
+            count = tree.mine_to(countSink(), minSup * batchSize, True, mode).count
+            elapsed = time.time() - start
+            result['mining'].append({'min_sup': minSup, 'mode': mode, 'itemsets': count, 'seconds': elapsed,
+                                     'itemsets_per_second': count / elapsed if elapsed else None})
+    result['baseline_rss_bytes'] = baseline
+    result['peak_rss_bytes'] = peak_rss()
+    return result
+
+def suite(argv):
+    """
+    benchmark.py suite: generate a synthetic stream (or read -d) and run
+    run_case over the grid of batch sizes, preMinSups and fadings, each in
+    a fresh process, printing the results as JSON.
+    """
+    usage = ("benchmark.py suite [-d <database>] [-T <avgLen>] [-I <avgPattern>] [-D <transactions>] [-N <items>] "
+             "[-r <seed>] [-b <batchSize,...>] [-p <preMinSup,...>] [-m <minSup,...>] [-f <fading,...>] "
+             "[-o <all,closed,maximal>] [-c] [-O <output.json>]")
+    database = ''
+    quest = {'T': 10, 'I': 4, 'D': 10000, 'N': 1000, 'seed': 0}
+    batchSizes = [100]
+    preMinSups = [0.005]
+    minSups = [0.02]
+    fadings = [0.6]
+    modes = None
+    canonical = False
+    output = ''
+    try:
+        opts, args = getopt.getopt(argv, "hd:T:I:D:N:r:b:p:m:f:o:cO:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt == '-d':
+            database = arg
+        elif opt in ('-T', '-I'):
+            quest[opt[1]] = float(arg)
+        elif opt in ('-D', '-N'):
+            quest[opt[1]] = int(arg)
+        elif opt == '-r':
+            quest['seed'] = int(arg)
+        elif opt == '-b':
+            batchSizes = [int(x) for x in arg.split(',')]
+        elif opt == '-p':
+            preMinSups = [float(x) for x in arg.split(',')]
+        elif opt == '-m':
+            minSups = [float(x) for x in arg.split(',')]
+        elif opt == '-f':
+            fadings = [float(x) for x in arg.split(',')]
+        elif opt == '-o':
+            modes = arg.split(',')
+        elif opt == '-c':
+            canonical = True
+        elif opt == '-O':
+            output = arg
+    if modes is None:
+        modes = ['all', 'closed', 'maximal'] if canonical else ['all']
+    if set(modes) - {'all'} and not canonical:
+        print("The closed and maximal modes need the canonical order (-c).", file=sys.stderr)
+        sys.exit(2)
+
+    directory = None
+    if not database:
+        directory = tempfile.mkdtemp()
+        database = os.path.join(directory, 'quest.data')
+        start = time.time()
+        generate_quest(database, quest['D'], quest['T'], quest['I'], quest['N'], seed=quest['seed'])
+        print("Generated {} transactions in {:.2f} seconds".format(quest['D'], time.time() - start), file=sys.stderr)
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = ''
+    report = {'revision': revision, 'python': platform.python_version(), 'machine': platform.machine(),
+              'database': None if directory else database, 'quest': quest if directory else None, 'results': []}
+    context = multiprocessing.get_context('fork')
+    try:
+        for batchSize, preMinSup, fading in itertools.product(batchSizes, preMinSups, fadings):
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (database, quest['D'] if directory else None, batchSize,
+                                               preMinSup, fading, minSups, modes, canonical))
+            print("batch {} preMinSup {} fading {} - {:.0f} tx/s, {} nodes".format(
+                batchSize, preMinSup, fading, result['transactions_per_second'] or 0, result['nodes']), file=sys.stderr)
+            report['results'].append(result)
+    finally:
+        if directory:
+            os.remove(database)
+            os.rmdir(directory)
+    text = json.dumps(report, indent=1)
+    if output:
+        with open(output, 'w') as target:
+            target.write(text)
+    else:
+        print(text)
+    return report
+
+def main(argv):
+    if len(argv) and argv[0] == 'suite':
+        suite(argv[1:])
+        return
+    database = ''
+    sampleSize = 10000
+    batchSize = 50
+    preMinSup = 0.005
+    canonical = False
+    ks = []
+    minSup = 0
+    minWeight = None
+    try:
+        opts, args = getopt.getopt(argv, "hd:s:b:p:ck:m:v:")
+    except getopt.GetoptError:
+        print("benchmark.py -d <database> -s <sampleSize> -b <batchSize> -p <preMinSup> [-c] [-k <k,k,...>] [-m <minSup> -v <minWeight>]")
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print("benchmark.py -d <database> -s <sampleSize> -b <batchSize> -p <preMinSup> [-c] [-k <k,k,...>] [-m <minSup> -v <minWeight>]")
+            sys.exit()
+        elif opt == '-d':
+            database = arg
+        elif opt == '-s':
+            sampleSize = int(arg)
+        elif opt == '-b':
+            batchSize = int(arg)
+        elif opt == '-p':
+            preMinSup = float(arg)
+        elif opt == '-c':
+            canonical = True
+        elif opt == '-k':
+            ks = [int(x) for x in arg.split(',')]
+        elif opt == '-m':
+            minSup = float(arg)
+        elif opt == '-v':
+            minWeight = float(arg)
+
+    test = loadData(database, sampleSize)
+    if minWeight is not None:
+        for name, row in backend_benchmark(test, batchSize, preMinSup, minSup, minWeight).items():
+            print("{} - insert {:.3f}s, mine {:.3f}s ({} itemsets)".format(
+                name, row['insert_seconds'], row['mine_seconds'], row['itemsets']))
+        return
+    # the top-k mining needs the canonical order
+    tree = Tree([], 1, 0.6, 'None', 0, canonical or bool(ks))
+    for index in range(0, len(test), batchSize):
+        tree.insert_transactions(test[index:index + batchSize], preMinSup * batchSize)
+    result = node_memory(tree)
+    print("Nodes - {}".format(result['nodes']))
+    print("dict node - {:.1f} bytes/node".format(result['dict_bytes_per_node']))
+    print("slots node - {:.1f} bytes/node".format(result['slots_bytes_per_node']))
+    for row in topk_benchmark(tree, ks):
+        print("top-{} - {:.3f}s, threshold {:.2f} - {:.3f}s ({} itemsets)".format(
+            row['k'], row['topk_seconds'], row['cutoff'], row['threshold_seconds'], row['itemsets']))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
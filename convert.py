@@ -0,0 +1,38 @@
+import sys
+import getopt
+
+from handler import convert_dataset
+
+USAGE = "convert.py -d <database> -o <output> [-f <quest/basket>] [-s <sampleSize>]"
+
+def main(argv):
+    database = ''
+    output = ''
+    fmt = 'auto'
+    sampleSize = None
+    try:
+        opts, args = getopt.getopt(argv, "hd:o:f:s:")
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE)
+            sys.exit()
+        elif opt == '-d':
+            database = arg
+        elif opt == '-o':
+            output = arg
+        elif opt == '-f':
+            fmt = arg
+        elif opt == '-s':
+            sampleSize = int(arg)
+    if not database or not output:
+        print(USAGE)
+        sys.exit(2)
+
+    items = convert_dataset(database, output, fmt, sampleSize)
+    print("Items - {}".format(len(items)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,14 +1,37 @@
 import sys
 import itertools
+import heapq
+import bisect
 import time
 import os
-from  multiprocessing.pool import Pool
+import mmap
+import array
+import struct
+import json
+import shutil
+import multiprocessing
+import threading
+import queue
 import concurrent.futures
 import getopt
 import gc
 import faulthandler
 
+# fanout above which a node indexes its children by name
+CHILD_INDEX_THRESHOLD = 8
+# ranking drift that makes a canonical tree rebuild itself in the new order
+RERANK_DRIFT = 0.25
+# landmark weight above which a lazy tree rescales its supports
+RESCALE_LIMIT = 1e100
+# relative difference under which two decayed supports are taken as equal
+SUPPORT_TOLERANCE = 1e-10
+# lines read to guess the format of a text database
+FORMAT_SAMPLE = 16
+
 class treeNode (object):
+    # no per-instance __dict__, the stream tree holds millions of nodes
+    __slots__ = ('name', 'support', 'batch', 'link', 'parent', 'children', 'depth')
+
     def __init__(self,name, support,parentNode):
         """
         Initialize the node.
@@ -18,34 +41,53 @@ class treeNode (object):
         self.batch = 0
         self.link = None
         self.parent = parentNode
-        self.children = []
+        # leaves share the empty tuple, a list is made on the first child and
+        # replaced by a name -> child dict once the node gets wide
+        self.children = ()
+        self.depth = 0 if parentNode is None else parentNode.depth + 1 # the root is at 0
 
     def has_child (self, value):
         """
         check if an item is already in the tree path
         """
-        for node in self.children:
-            if node.name == value:
-                return True
-        return False
+        return self.get_child(value) is not None
+
     def add_child (self, value):
         """
         Add a node as a child.
         """
         child = treeNode(value,1,self)
-        self.children.append(child)
+        children = self.children
+        if type(children) is dict:
+            children[value] = child
+        elif len(children):
+            children.append(child)
+            if len(children) > CHILD_INDEX_THRESHOLD:
+                self.children = {node.name: node for node in children}
+        else:
+            self.children = [child]
         return child
+
     def get_child (self, value):
         """
         return the node with the a particular key
         """
-
-        for node in self.children:
+        children = self.children
+        if type(children) is dict:
+            return children.get(value)
+        for node in children:
             if node.name == value:
                 return node
 
         return None
 
+    def child_nodes (self):
+        """
+        The children, in insertion order, whether they are indexed or not.
+        """
+        children = self.children
+        return children.values() if type(children) is dict else children
+
     def increase(self, support):
         """
         increase the support of the node.
@@ -54,23 +96,437 @@ class treeNode (object):
 
     def display (self,ind=1):
         print('-'*ind,self.name,' ', self.support,' ',self.batch)
-        for child in self.children:
+        for child in self.child_nodes():
             child.display(ind+1)   
 
+class conditionalNode (object):
+    """
+    Node of a conditional tree.
+    """
+    __slots__ = ('name', 'support', 'parent', 'children')
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.support = 0
+        self.parent = parent
+        self.children = {}
+
+class conditionalTree (object):
+    """
+    FP-tree built over a weighted conditional pattern base.
+    """
+    def __init__(self, base, threshold, exclude=(), stats=None):
+        """
+        base - list of (items, support) pairs
+        threshold - minimum support for an item to enter the tree
+        exclude - items left out of the tree
+        stats - treeStats counting the candidate extensions, if any
+        """
+        counts = base_counts(base)
+        for item in exclude:
+            del counts[item]
+        self.stats = stats
+        if stats is not None:
+            stats.patterns_enumerated += len(counts)
+        # most frequent items first so the paths share prefixes
+        self.order = sorted([x for x in counts if counts[x] >= threshold], key=counts.get, reverse=True)
+        self.counts = {x: counts[x] for x in self.order}
+        self.threshold = threshold
+        self.root = conditionalNode(None, None)
+        self.headers = {x: [] for x in self.order}
+        self.single_path = True
+        rank = {x: i for i, x in enumerate(self.order)}
+        for items, support in base:
+            path = sorted([x for x in items if x in rank], key=rank.get)
+            node = self.root
+            for item in path:
+                child = node.children.get(item)
+                if child is None:
+                    child = conditionalNode(item, node)
+                    node.children[item] = child
+                    self.headers[item].append(child)
+                    if len(node.children) > 1:
+                        self.single_path = False
+                child.support += support
+                node = child
+
+    def mine(self, suffix, emit, bound=None, max_len=None):
+        """
+        Emit every frequent itemset of the tree extended by suffix.
+        bound - object whose threshold may rise while mining, as in top-k
+        max_len - length of the longest itemset emitted
+        """
+        threshold = self.threshold if bound is None else bound.threshold
+        if max_len is not None and len(suffix) >= max_len:
+            return
+        if self.single_path:
+            # every combination of a single path is frequent, with the
+            # support of its deepest item.
+            path = [x for x in self.order if self.counts[x] >= threshold]
+            longest = len(path) if max_len is None else min(len(path), max_len - len(suffix))
+            for i in range(1, longest+1):
+                for subset in itertools.combinations(path, i):
+                    support = self.counts[subset[-1]]
+                    if bound is None or support >= bound.threshold:
+                        emit(tuple(sorted(subset + suffix)), support)
+            return
+        for item in reversed(self.order):
+            support = self.counts[item]
+            if bound is not None and support < bound.threshold:
+                continue
+            pattern = suffix + (item,)
+            emit(tuple(sorted(pattern)), support)
+            if max_len is not None and len(pattern) >= max_len:
+                continue
+            base = self.conditional(item)
+            if len(base):
+                threshold = self.threshold if bound is None else max(self.threshold, bound.threshold)
+                conditionalTree(base, threshold, (), self.stats).mine(pattern, emit, bound, max_len)
+
+    def conditional(self, item):
+        """
+        Conditional pattern base of an item of the tree.
+        """
+        base = []
+        for node in self.headers[item]:
+            path = []
+            current = node.parent
+            while current.name is not None:
+                path.append(current.name)
+                current = current.parent
+            if len(path):
+                base.append((path, node.support))
+        return base
+
+    def mine_closed(self, suffix, emit, found):
+        """
+        Emit the closed itemsets of the tree extended by suffix.  The items
+        of a conditional base as frequent as its pattern are merged into
+        the pattern, and a pattern contained in a closed itemset of the
+        same support found earlier is pruned with its whole branch.
+        """
+        for item in reversed(self.order):
+            support = self.counts[item]
+            base = self.conditional(item)
+            pattern, closure = closed_pattern(suffix + (item,), base, support)
+            if found.subsumed(pattern, support):
+                continue
+            emit(pattern, support)
+            found.add(pattern, support)
+            if len(base):
+                conditionalTree(base, self.threshold, closure, self.stats).mine_closed(suffix + (item,) + closure, emit, found)
+
+    def mine_maximal(self, suffix, support, emit, found):
+        """
+        Emit the maximal itemsets of the tree extended by suffix, whose
+        support is given.  A branch is pruned when its pattern together
+        with every item of its conditional tree is contained in a maximal
+        itemset found earlier.
+        """
+        if self.single_path:
+            pattern = tuple(sorted(suffix + tuple(self.order)))
+            if len(self.order):
+                support = self.counts[self.order[-1]]
+            if not found.subsumed(pattern):
+                emit(pattern, support)
+                found.add(pattern, support)
+            return
+        for item in reversed(self.order):
+            pattern = suffix + (item,)
+            tree = conditionalTree(self.conditional(item), self.threshold, (), self.stats)
+            if found.subsumed(pattern + tuple(tree.order)):
+                continue
+            tree.mine_maximal(pattern, self.counts[item], emit, found)
+
+def base_counts(base):
+    """
+    Support of every item of a conditional pattern base.
+    """
+    counts = {}
+    for items, support in base:
+        for item in items:
+            counts[item] = counts.get(item,0) + support
+    return counts
+
+def closed_pattern(pattern, base, support):
+    """
+    Merge into the pattern the items of its conditional base that occur in
+    every one of its transactions.  Returns the sorted closed pattern and
+    the merged items.
+    """
+    counts = base_counts(base)
+    closure = tuple(x for x in counts if counts[x] >= support - support * SUPPORT_TOLERANCE)
+    return tuple(sorted(pattern + closure)), closure
+
+def tilt_window(window, batch, count, limit):
+    """
+    Add count transactions of a batch to a tilted-time window, a flat list
+    of (start, end, count) buckets, oldest first, each one counting the
+    batches in [start, end).  Returns the window, a new one for None.
+    """
+    if window is None:
+        return [batch, batch + 1, count]
+    if window[-3] == batch:
+        window[-1] += count
+        return window
+    window.extend((batch, batch + 1, count))
+    compact_window(window, batch, limit)
+    return window
+
+def compact_window(window, now, limit):
+    """
+    Drop the buckets older than limit batches before now and merge the
+    adjacent ones that fit in an aligned block of the size allowed at
+    their age: one batch for the newest, then blocks of 2^l batches once
+    the newest batch of the block is about 2^(l+1) batches old.  Gaps of
+    batches without transactions are merged away like any other batch, so
+    a window holds O(log limit) buckets.
+    """
+    first = 0
+    while window[first + 1] <= now + 1 - limit:
+        first += 3
+    if first:
+        del window[:first]
+    i = len(window) - 6
+    while i >= 0:
+        start, end = window[i], window[i + 4]
+        size = 1 << ((now - end + 3).bit_length() - 2)
+        if end - start <= size and start // size == (end - 1) // size:
+            window[i + 1] = end
+            window[i + 2] += window[i + 5]
+            del window[i + 3:i + 6]
+        i -= 3
+
+def window_count(window, now, horizon):
+    """
+    Count of a tilted-time window over the horizon batches before now.  A
+    bucket the horizon only partly covers counts in proportion of its
+    covered batches; it is the oldest bucket read and at most about half
+    as long as the horizon.
+    """
+    if window is None:
+        return 0
+    start = now - horizon
+    total = 0
+    i = len(window) - 3
+    while i >= 0:
+        first, end, count = window[i], window[i + 1], window[i + 2]
+        if end <= start:
+            break
+        if first >= start:
+            total += count
+        else:
+            total += count * (end - start) / (end - first)
+        i -= 3
+    return total
+
+class itemsetIndex (object):
+    """
+    The closed or maximal itemsets found so far, indexed by item for the
+    subsumption checks.
+    """
+    def __init__(self):
+        self.items = {} # item -> list of (support, itemset)
+
+    def add(self, pattern, support):
+        entry = (support, frozenset(pattern))
+        for item in pattern:
+            self.items.setdefault(item, []).append(entry)
+
+    def subsumed(self, pattern, support=None):
+        """
+        Whether an itemset containing the pattern was found, with the same
+        support when one is given.
+        """
+        candidates = min((self.items.get(x, ()) for x in pattern), key=len)
+        if not len(candidates):
+            return False
+        pattern = frozenset(pattern)
+        for other, itemset in candidates:
+            if support is not None and abs(other - support) > support * SUPPORT_TOLERANCE:
+                continue
+            if pattern <= itemset:
+                return True
+        return False
+
+class topkCollector (object):
+    """
+    Bounded min-heap of the k best itemsets found so far.  Once it is full
+    its threshold is the support of the weakest itemset, which no branch
+    under it can beat.
+    """
+    def __init__(self, k, min_len=1):
+        self.k = k
+        self.min_len = min_len
+        self.heap = []
+        self.threshold = 0
+
+    def emit(self, pattern, support):
+        if len(pattern) < self.min_len:
+            return
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (support, pattern))
+            if len(self.heap) == self.k:
+                self.threshold = self.heap[0][0]
+        elif support > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (support, pattern))
+            self.threshold = self.heap[0][0]
+
+    def result(self):
+        """
+        The itemsets and supports, best first.
+        """
+        return [(pattern, support) for support, pattern in sorted(self.heap, reverse=True)]
+
+class multiThreshold (object):
+    """
+    Itemsets mined once at the lowest of several thresholds, sorted by
+    decreasing support so the result of every threshold is a prefix.
+    """
+    def __init__(self, thresholds, records):
+        records.sort(key=lambda x: x[1], reverse=True)
+        self.thresholds = sorted(thresholds)
+        self.records = records
+        self.keys = [-support for pattern, support in records]
+        self.supports = None
+
+    def count(self, threshold):
+        """
+        Number of itemsets whose support reaches the threshold.
+        """
+        if threshold < self.thresholds[0]:
+            raise ValueError("mined at {}, below which nothing is known".format(self.thresholds[0]))
+        return bisect.bisect_right(self.keys, -threshold)
+
+    def itemsets(self, threshold):
+        """
+        The (itemset, support) records of a threshold, best first.
+        """
+        return self.records[:self.count(threshold)]
+
+    def __getitem__(self, threshold):
+        return dict(self.itemsets(threshold))
+
+    def thresholds_met(self, pattern):
+        """
+        The thresholds the support of an itemset reaches.
+        """
+        if self.supports is None:
+            self.supports = dict(self.records)
+        support = self.supports.get(tuple(sorted(pattern)), 0)
+        return [x for x in self.thresholds if support >= x]
+
+class treeStats (object):
+    """
+    Counters of the work done by a tree, and latency histograms of its
+    batch insertions and of the mining of each header item in powers of
+    two of microseconds.
+    """
+    COUNTERS = ('batches', 'transactions', 'nodes_created', 'child_probes', 'child_scans',
+                'link_steps', 'decay_computations', 'patterns_enumerated', 'patterns_kept')
+
+    def __init__(self, log_every=0):
+        for key in self.COUNTERS:
+            setattr(self, key, 0)
+        self.log_every = log_every
+        self.histograms = {'insert': [], 'mine': []}
+
+    def record(self, kind, seconds):
+        bucket = int(seconds * 1e6).bit_length()
+        histogram = self.histograms[kind]
+        if len(histogram) <= bucket:
+            histogram.extend([0] * (bucket + 1 - len(histogram)))
+        histogram[bucket] += 1
+
+    def counted(self, emit):
+        """
+        Wrap an emit so the itemsets it receives are counted as kept.
+        """
+        def counting(pattern, support):
+            self.patterns_kept += 1
+            emit(pattern, support)
+        return counting
+
+    def percentile(self, kind, fraction):
+        """
+        Upper bound in microseconds of the bucket holding a percentile.
+        """
+        histogram = self.histograms[kind]
+        rank = fraction * sum(histogram)
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= rank:
+                return 1 << bucket
+        return 0
+
+    def snapshot(self):
+        """
+        The counters and histograms as a dict; a histogram maps the upper
+        bound of each bucket in microseconds to its count.
+        """
+        result = {key: getattr(self, key) for key in self.COUNTERS}
+        for kind, histogram in self.histograms.items():
+            result[kind + '_latency_us'] = {1 << bucket: count for bucket, count in enumerate(histogram) if count}
+        return result
+
+    def json(self):
+        return json.dumps(self.snapshot())
+
+    def line(self, nodes):
+        return "stats batch {} - nodes {} (+{}), probes {}, scans {}, links {}, decays {}, patterns {}/{}, insert p50 {}us p99 {}us".format(
+            self.batches, nodes, self.nodes_created, self.child_probes, self.child_scans, self.link_steps,
+            self.decay_computations, self.patterns_kept, self.patterns_enumerated,
+            self.percentile('insert', 0.5), self.percentile('insert', 0.99))
+
 class Tree (object):
     """
     A stream tree.
     """
-    def __init__(self, transactions,threshold,fading,root_value,root_count):
+    def __init__(self, transactions,threshold,fading,root_value,root_count,canonical=False,rerank=10,lazy=False,epsilon=0,prune_every=0,max_nodes=0,window=0):
         """
         Initialization of the tree
+        canonical - insert the items of a transaction ordered by their decayed support
+        rerank - number of batches between two re-rankings of the items (0 never re-ranks)
+        lazy - keep the supports in the scale of a landmark batch instead of fading every node
+        epsilon - decayed support below which the branches are pruned
+        prune_every - number of batches between two pruning passes (0 never prunes)
+        max_nodes - prune whenever the tree holds more nodes (0 means no budget)
+        window - number of batches kept in a tilted-time window of raw counts on
+        every node, for the supports over the last batches (0 keeps none).  The
+        windows cannot be split among the paths of a rebuild, so a canonical
+        tree with windows keeps its ranking
         """
-        self.frequent = self.find_frequent(transactions,threshold)
-        self.headers = self.build_header_table(self.frequent)
-        self.root = self.build_tree(transactions,root_value,root_count,self.frequent,self.headers)
         self.fading = fading
+        self.lazy = lazy
+        self.landmark = 0
+        self.weight = 1 # support of a transaction of the current batch, in the landmark scale
+        self.unit = 1 # weight of a transaction of the last batch, dividing a landmark value into its decayed support
         self.minsup = 0 # this attribute is going to be set on the mining time.
         self.purged = []
+        self.tails = {} # last node of each header chain, so new nodes are appended in O(1)
+        self.nodes = 0
+        self.canonical = canonical
+        self.rerank = rerank
+        self.counts = {} # decayed count of every item read, in the landmark scale
+        self.total = 0 # decayed count of the transactions read, in the landmark scale
+        self.rank = {} # item -> position in the canonical order
+        self.epsilon = epsilon
+        self.prune_every = prune_every
+        self.max_nodes = max_nodes
+        self.error = 0 # decayed support removed by pruning, bounds the underestimation of any itemset
+        self.cache = {} # item -> (batch, threshold, itemsets) of its last mining
+        self.touched = set() # items inserted or pruned since they were mined
+        self.stats = None # treeStats while enable_stats is on
+        self.window = window
+        self.windows = {} # node -> tilted-time window of its raw counts, see tilt_window; empty without self.window
+        self.horizon = None # batches counted by the tilted-time windows while mining, None for the decayed supports
+        self.frequent = self.find_frequent(transactions,threshold)
+        for key in sorted(self.frequent, key=lambda x: (-self.frequent[x], x)):
+            self.rank[key] = len(self.rank)
+        self.headers = self.build_header_table(self.frequent)
+        self.root = self.build_tree(transactions,root_value,root_count,self.frequent,self.headers)
+        self.update_scale()
 
     @staticmethod
     def find_frequent(transactions, threshold):
@@ -102,46 +558,84 @@ class Tree (object):
         """
         Generate a list of patterns with support counts
         """
-        patterns = {}        
-        for item in nodes:
-            items = []
-            auxDict = {}
-            if item.parent.parent == None:
-                patterns[tuple(item.name)] = self.update_support(item,True) #item.support
-            else:
-                current = item
-                suffix = (current.name,)                
-                auxDict[current.name] = self.update_support(item,True) #current.support
-                while current.parent.parent is not None:
-                    current = current.parent
-                    items.append(current.name)
-                    auxDict[current.name] = self.update_support(item,True) #current.support                
-                for i in range(1,len(items)+1):
-                    for subset in itertools.combinations(items,i):
-                        #if item.name in subset:
-                            pattern = tuple(sorted(list(subset +suffix)))
-                            patterns[pattern] = patterns.get(pattern,0) + min([auxDict[x] for x in subset])         
-                            #Verify, this code maybe improved using the suffix support instead of finding the smaller one.
+        patterns = {}
+        def accumulate(pattern, support):
+            patterns[pattern] = patterns.get(pattern,0) + support
+        for name in {node.name for node in nodes}:
+            base = []
+            for node in nodes:
+                if node.name == name:
+                    base.append((self.prefix_path(node, ()), self.update_support(node,True)))
+            conditionalTree(base, 0).mine((name,), accumulate)
         return patterns
+
+    def prefix_path(self, node, purged):
+        """
+        Return the names of the ancestors of a node, skipping purged items.
+        """
+        path = []
+        current = node.parent
+        while current.parent is not None:
+            if current.name not in purged:
+                path.append(current.name)
+            current = current.parent
+        return path
+
+    def conditional_base(self, item, purged):
+        """
+        Build the decayed conditional pattern base of an header item, or the
+        one counted by the tilted-time windows while self.horizon is set.
+        Returns the list of (prefix path, support) pairs and the item support.
+        """
+        base = []
+        support = 0
+        unit = self.unit if self.lazy else None
+        horizon = self.horizon
+        node = self.headers[item]
+        while node is not None:
+            if horizon is not None:
+                weight = window_count(self.windows.get(node), self.root.batch, horizon)
+            elif unit is None:
+                weight = self.update_support(node,True)
+            else:
+                weight = node.support / unit
+            support += weight
+            path = self.prefix_path(node, purged)
+            if len(path):
+                base.append((path, weight))
+            if self.stats is not None:
+                self.stats.link_steps += 1
+                if unit is not None:
+                    self.stats.decay_computations += 1
+            node = node.link
+        return base, support
     
-    def update_support(self,node, ismining):
+    def update_support(self,node, ismining, increment=1):
         """
         Compare the batch number between the node and the root.
         Update the value accordingly.
         """
+        if self.lazy:
+            if ismining:
+                return node.support / self.unit
+            node.support += increment * self.weight
+            return node.support / self.weight
         if ismining:
             sup = 0
             rBatch = self.root.batch -1
         else:
-            sup = 1
+            sup = increment
             rBatch = self.root.batch
         if node.batch == rBatch:
-            node.support += sup
+            if sup:
+                node.support += sup
         else:
             """ for i in range((rBatch - node.batch)):
                 node.support *= self.fading """
             node.support *= pow(self.fading,(rBatch - node.batch)) 
             node.support += sup
+            if self.stats is not None:
+                self.stats.decay_computations += 1
             node.batch = rBatch
         return node.support
     
@@ -157,175 +651,1493 @@ class Tree (object):
         """
         Apply alfa to all nodes
         """
-        for i in node.children:
-            #i.support *= alfa
-            self.update_support(i,True)
-            self.apply_fading(i)
+        stack = list(node.child_nodes())
+        while len(stack):
+            current = stack.pop()
+            self.update_support(current,True)
+            stack.extend(current.child_nodes())
+
+    def fade_nodes(self):
+        """
+        Fade every node to the last batch, so mining only reads the tree.
+        """
+        if not self.lazy:
+            self.apply_fading(self.root)
     
     def insert_transactions(self, transactions, threshold):
         """
         Function to insert new batches.
+        The decayed count of each item is updated as the transactions are
+        read, and an item enters the tree once its count, which carries the
+        faded counts of the previous batches, reaches threshold.
         """
-        #self.apply_fading(self.root,0.6)
-
-        self.frequent = self.find_frequent(transactions,threshold)
-        self.update_header_table(self.frequent)
-        if len(self.headers) == 0:
-            self.headers = self.build_header_table(self.frequent)
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+            nodes = self.nodes
+        if self.canonical:
+            self.update_ranking(self.root.batch)
+        counts = self.counts
+        weight = self.weight
+        limit = threshold * weight
+        rank = self.rank
+        self.total += len(transactions) * weight
         for transaction in transactions:
-            transactionList = [x for x in transaction if x in self.frequent]
+            transactionList = []
+            for item in transaction:
+                count = counts.get(item,0) + weight
+                counts[item] = count
+                if count >= limit:
+                    transactionList.append(item)
             if len(transactionList):
+                if self.canonical:
+                    for item in transactionList:
+                        if item not in rank:
+                            rank[item] = len(rank)
+                    transactionList.sort(key=rank.__getitem__)
                 self.insert_tree(transactionList, self.root, self.headers)
+        if stats is not None:
+            stats.transactions += len(transactions)
+            stats.nodes_created += self.nodes - nodes
+            stats.record('insert', time.perf_counter() - start)
+        self.end_batch()
+
+    def end_batch(self, batches=1):
+        """
+        Close the current batch: move the root to the next one and run the
+        scheduled pruning.  batches is the number of batches it closes,
+        more than one when a run of batches was merged at once.
+        """
         self.root.batch += 1
+        self.update_scale()
+        self.error *= self.fading
+        if self.prune_every and self.root.batch // self.prune_every > (self.root.batch - batches) // self.prune_every:
+            self.prune(self.epsilon)
+        if self.max_nodes and self.nodes > self.max_nodes:
+            self.prune_to_budget(self.max_nodes)
+        if self.stats is not None:
+            self.stats.batches += batches
+            every = self.stats.log_every
+            if every and self.stats.batches // every > (self.stats.batches - batches) // every:
+                print(self.stats.line(self.nodes))
+
+    def paths(self, root=None):
+        """
+        Yield the path of every node that ends transactions, with the
+        decayed support of those transactions at the last batch: the
+        support of the node minus what it passes to its children.
+        """
+        if root is None:
+            root = self.root
+        stack = [(child, [child.name]) for child in root.child_nodes()]
+        while len(stack):
+            node, path = stack.pop()
+            support = self.update_support(node,True)
+            own = support - sum(self.update_support(child,True) for child in node.child_nodes())
+            if own > support * 1e-9:
+                yield path, own
+            stack.extend((child, path + [child.name]) for child in node.child_nodes())
+
+    def merge(self, other):
+        """
+        Append the stream of another tree after the batches of this one,
+        as if its batches had been inserted here.
+        """
+        counts = {key: count / other.unit for key, count in other.counts.items()}
+        self.merge_paths(other.paths(), max(other.root.batch,1), other.error, None, counts, other.decayed_transactions())
+
+    def merge_paths(self, paths, batches=1, error=0, threshold=None, counts=None, total=None):
+        """
+        Insert the (path, support) pairs of a tree holding batches batches
+        as the next batches of this tree.  The supports are the decayed ones
+        at the last of those batches, so each path keeps its fading.
+        counts - decayed item counts of those batches, by default the path supports
+        total - decayed transaction count of those batches, by default the sum
+        of the path supports
+        A tree with tilted-time windows only takes single batches, whose
+        path supports are raw counts.
+        threshold - admit the items as insert_transactions does; the counts
+        of the whole batches are added before, where insert_transactions
+        only sees the transactions read so far
+        """
+        if self.window and batches > 1:
+            raise ValueError("the tilted-time windows need the raw counts of every batch, not a merged run")
+        paths = list(paths)
+        if batches > 1:
+            self.root.batch += batches - 1
+            self.update_scale()
+            self.error *= pow(self.fading, batches - 1)
+        if counts is None:
+            counts = {}
+            for path, support in paths:
+                for item in path:
+                    counts[item] = counts.get(item,0) + support
+        weight = self.weight
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key,0) + count * weight
+        if total is None:
+            total = sum(support for path, support in paths)
+        self.total += total * weight
+        if self.canonical:
+            self.update_ranking(self.root.batch)
+            rank = self.rank
+            new = [x for x in counts if x not in rank]
+            new.sort(key=lambda x: (-counts[x], x))
+            for key in new:
+                rank[key] = len(rank)
+        if threshold is not None:
+            limit = threshold * weight
+            admitted = {key for key in counts if self.counts[key] >= limit}
+        for path, support in paths:
+            if threshold is not None:
+                path = [x for x in path if x in admitted]
+                if not len(path):
+                    continue
+            if self.canonical:
+                path = sorted(path, key=rank.__getitem__)
+            self.insert_tree(path, self.root, self.headers, support)
+        self.end_batch(batches)
+        # the error of the other tree is already faded to its last batch
+        self.error += error
+
+    def update_scale(self):
+        """
+        Set the landmark weights for the current batch of the root.  When
+        the weight of a new transaction gets too big the landmark moves to
+        the current batch and the item counts, and the node supports of a
+        lazy tree, are rescaled.
+        """
+        self.weight = pow(self.fading, self.landmark - self.root.batch)
+        if self.weight > RESCALE_LIMIT:
+            if self.lazy:
+                for key in self.headers:
+                    node = self.headers[key]
+                    while node is not None:
+                        node.support /= self.weight
+                        node = node.link
+            for key in self.counts:
+                self.counts[key] /= self.weight
+            self.total /= self.weight
+            self.landmark = self.root.batch
+            self.weight = 1
+        # the very weight the last batch was inserted with, so its supports read back exactly
+        self.unit = pow(self.fading, self.landmark - (self.root.batch - 1))
+
+    def update_ranking(self, batch):
+        """
+        New items are ranked after the known ones as they enter the tree.
+        Every rerank batches, if the decayed counts drifted away from the
+        ranking, the items are ranked again and the tree is rebuilt in the
+        new order.
+        """
+        counts = self.counts
+        if self.rerank and not self.window and batch and batch % self.rerank == 0:
+            order = sorted(self.rank, key=lambda x: (-counts[x], self.rank[x]))
+            # support weighted displacement of the items, batch noise stays well below the bound
+            total = sum(counts[x] for x in order) * len(order)
+            drift = sum(counts[x] * abs(i - self.rank[x]) for i, x in enumerate(order))
+            if total and drift / total > RERANK_DRIFT:
+                self.rank = {x: i for i, x in enumerate(order)}
+                self.restructure()
+
+    def restructure(self):
+        """
+        Rebuild the tree with every path sorted by the current ranking.
+        The support a node does not pass to its children belongs to the
+        transactions ending there, so reinserting each path with that
+        support keeps every itemset support.  The paths whose support
+        faded to nothing are lost, and the headers they leave empty are
+        dropped, as prune does.
+        """
+        old = self.root
+        self.invalidate()
+        self.root = treeNode(old.name,old.support,None)
+        self.root.batch = old.batch
+        self.headers = {key: None for key in self.headers}
+        self.tails = {}
+        self.nodes = 0
+        rank = self.rank
+        for path, support in self.paths(old):
+            # the insertion batch is one batch after the mined supports
+            self.insert_tree(sorted(path, key=rank.__getitem__), self.root, self.headers, support * self.fading)
+        for key in [x for x, node in self.headers.items() if node is None]:
+            del self.headers[key]
+
+    def prune(self, epsilon):
+        """
+        Remove the branches whose decayed support fell below epsilon.
+        Supports only decrease from a node to its children, so a whole
+        subtree goes with its top node.  The header chains of the removed
+        items are relinked and the headers left empty are dropped.
+
+        Like lossy counting, the removed support is an error bound: every
+        transaction below a pruned node contributes at most once to an
+        itemset, so no support is underestimated by more than the decayed
+        support removed so far (self.error), which fades with the tree.
+        Pruning every N batches at epsilon adds at most epsilon per pruned
+        branch, and a pruned branch never held more than epsilon / fading^N
+        when the previous pass kept it.
+        Returns the number of removed nodes.
+        """
+        removed = 0
+        items = set()
+        stack = [self.root]
+        while len(stack):
+            node = stack.pop()
+            keep = []
+            for child in node.child_nodes():
+                support = self.update_support(child,True)
+                if support >= epsilon:
+                    keep.append(child)
+                    continue
+                self.error += support
+                # mark the subtree as removed for the header chains
+                dead = [child]
+                while len(dead):
+                    current = dead.pop()
+                    current.parent = None
+                    self.windows.pop(current, None)
+                    items.add(current.name)
+                    removed += 1
+                    dead.extend(current.child_nodes())
+            if len(keep) < len(node.children):
+                if len(keep) > CHILD_INDEX_THRESHOLD:
+                    node.children = {child.name: child for child in keep}
+                else:
+                    node.children = keep if len(keep) else ()
+            stack.extend(keep)
+        for item in items:
+            head = tail = None
+            node = self.headers[item]
+            while node is not None:
+                if node.parent is not None:
+                    if tail is None:
+                        head = node
+                    else:
+                        tail.link = node
+                    tail = node
+                node = node.link
+            if tail is None:
+                del self.headers[item]
+                self.tails.pop(item, None)
+            else:
+                tail.link = None
+                self.headers[item] = head
+                self.tails[item] = tail
+        self.nodes -= removed
+        self.touched.update(items)
+        return removed
+
+    def prune_to_budget(self, max_nodes):
+        """
+        Prune with a doubling epsilon until the tree fits in max_nodes.
+        """
+        epsilon = self.epsilon if self.epsilon > 0 else 1e-3
+        while self.nodes > max_nodes:
+            self.prune(epsilon)
+            epsilon *= 2
 
     def build_tree (self, transactions, root_value,root_count,frequent,headers):
         """
         create the tree with the transactions.
         """
-        root = treeNode(root_value,root_count,None)
+        self.root = treeNode(root_value,root_count,None)
         for transaction in transactions:
+            self.total += self.weight
+            for item in transaction:
+                self.counts[item] = self.counts.get(item,0) + self.weight
             transactionList = [x for x in transaction if x in frequent]
             if len(transactionList):
-                self.insert_tree(transactionList, root, headers)
-        return root
+                if self.canonical:
+                    transactionList.sort(key=self.rank.__getitem__)
+                self.insert_tree(transactionList, self.root, headers)
+        return self.root
 
-    def insert_tree(self, items, node, headers):
+    def insert_tree(self, items, node, headers, support=1):
         """
         insert transaction items into the tree.
         """
-        first = items[0]
-        child = node.get_child(first)
-        if child is not None:
-            #child.support += 1
-            self.update_support(child,False)
-        else:
-            #add a new children
-            child = node.add_child(first)
-            child.batch = self.root.batch
-            if headers[first] is None:
-                headers[first] = child
+        tails = self.tails
+        touched = self.touched
+        batch = self.root.batch
+        lazy = self.lazy
+        increment = support * self.weight if lazy else support
+        window = self.window
+        windows = self.windows
+        stats = self.stats
+        for item in items:
+            touched.add(item)
+            if stats is not None:
+                stats.child_probes += 1
+                if type(node.children) is not dict:
+                    stats.child_scans += len(node.children)
+            child = node.get_child(item)
+            if child is not None:
+                if lazy:
+                    child.support += increment
+                else:
+                    self.update_support(child,False,support)
             else:
-                current = headers[first]
-                while current.link is not None:
-                    current = current.link
-                current.link = child
-        #call the function recursively to add the remain items.
-        remaining_items = items[1:]
-        if len(remaining_items) > 0:
-            self.insert_tree(remaining_items,child,headers)
+                #add a new children and append it to the header chain
+                child = node.add_child(item)
+                child.support = increment
+                child.batch = batch
+                self.nodes += 1
+                if headers.get(item) is None:
+                    headers[item] = child
+                else:
+                    tails[item].link = child
+                tails[item] = child
+            if window:
+                windows[child] = tilt_window(windows.get(child), batch, support, window)
+            node = child
+
     ## Mine Functions!!!
     def clean_singleton(self, threshold):
         """
         purge singletons which does not met Minsup Criteria                
+        The decayed count of an item bounds its support in the tree, so
+        an item whose count is below the threshold cannot be frequent.
         """
         result = list()        
         self.purged.clear()
         for key in self.headers.keys():
-            sup = 0
-            node = self.headers[key]
-            sup += node.support
-            while node.link is not None:
-                node = node.link
-                sup += node.support
+            sup = self.counts.get(key,0) / self.unit
             if sup >= threshold:
                 result.append(key)
             else:
                 self.purged.append(key)
         if len(self.purged) > 0:
-            print(self.purged)
+            print(self.purged, file=sys.stderr)
         return result
 
-    def mine_itemsets_thread (self, threshold):
-        self.minsup = threshold
-        singletons, purged = self.clean_singleton(threshold)      
-        #singletons.sort(reverse = True) 
-        with Pool(4) as p:
-            yield p.map(self.mine_singleton,singletons)
-        #return frequent
+    def decayed_transactions(self):
+        """
+        Decayed count of the transactions read at the last batch, those
+        left with no item in the tree included.
+        """
+        return self.total / self.unit
+
+    def node_support(self, node):
+        """
+        Decayed support of a node at the last batch, without fading it.
+        """
+        if self.lazy:
+            return node.support / self.unit
+        return node.support * pow(self.fading, self.root.batch - 1 - node.batch)
+
+    def support(self, itemset):
+        """
+        Decayed support of an itemset at the last batch.
+        """
+        return self.supports([itemset])[0]
+
+    def supports(self, itemsets, horizon=None):
+        """
+        Decayed supports of many itemsets at the last batch, or their counts
+        over the last horizon batches from the tilted-time windows.  A transaction
+        holding an itemset is counted at the node of its deepest item, so
+        only the chains of those items are walked, each one once for all
+        the itemsets sharing it, looking for the rest of the itemsets among
+        the ancestors of its nodes.  With the canonical order the deepest
+        item is the one of highest rank and the walk up stops below the
+        ranks looked for; otherwise the chain of every item is walked.
+        Nodes too shallow to hold the rest are skipped by their depth.
+        """
+        result = [0] * len(itemsets)
+        groups = {} # item walked -> [(index, rest of the itemset)]
+        rank = self.rank
+        for index, itemset in enumerate(itemsets):
+            itemset = frozenset(itemset)
+            if not len(itemset) or not all(x in self.headers for x in itemset):
+                continue
+            if self.canonical:
+                walks = (max(itemset, key=rank.__getitem__),)
+            else:
+                walks = itemset
+            for item in walks:
+                groups.setdefault(item, []).append((index, itemset - {item}))
+        for item, queries in groups.items():
+            needed = frozenset().union(*(rest for index, rest in queries))
+            shortest = min(len(rest) for index, rest in queries)
+            floor = min(rank[x] for x in needed) if self.canonical and len(needed) else None
+            node = self.headers[item]
+            while node is not None:
+                if node.depth > shortest:
+                    ancestors = set()
+                    current = node.parent
+                    while current.parent is not None and len(ancestors) < len(needed):
+                        if floor is not None and rank[current.name] < floor:
+                            break
+                        if current.name in needed:
+                            ancestors.add(current.name)
+                        current = current.parent
+                    weight = None
+                    for index, rest in queries:
+                        if rest <= ancestors:
+                            if weight is None:
+                                if horizon is None:
+                                    weight = self.node_support(node)
+                                else:
+                                    weight = window_count(self.windows.get(node), self.root.batch, horizon)
+                            result[index] += weight
+                node = node.link
+        return result
+
+    def mine_itemsets_thread (self, threshold, purge=True, workers=None):
+        """
+        Mine the frequent itemsets with a pool of worker processes.
+        The workers are forked after the tree is published in a module
+        global, so they inherit it instead of receiving it pickled; each
+        task only carries an header item and returns its itemsets, which
+        are yielded as they arrive.
+        """
+        global sharedTree
+        singletons = self.select_singletons(threshold, purge)
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            # no fork on this platform, mine sequentially
+            for single in singletons:
+                yield self.mine_singleton(single)
+            return
+        # fade every node now so the workers do not write to the shared pages
+        self.fade_nodes()
+        # longest header chains first to balance the workers
+        singletons.sort(key=self.chain_length, reverse=True)
+        workers = workers or os.cpu_count()
+        chunksize = max(1, len(singletons) // (workers * 8))
+        sharedTree = self
+        gc.freeze()
+        try:
+            with context.Pool(workers) as pool:
+                for frequent in pool.imap_unordered(mine_shared_singleton, singletons, chunksize):
+                    yield frequent
+        finally:
+            gc.unfreeze()
+            sharedTree = None
+
+    def chain_length(self, item):
+        """
+        Number of nodes in the header chain of an item.
+        """
+        length = 0
+        node = self.headers[item]
+        while node is not None:
+            length += 1
+            node = node.link
+        return length
                 
-    def mine_singleton(self,singleton):
+    def select_singletons(self, threshold, purge):
+        """
+        The header items to mine at a threshold, without the ones that
+        cannot be frequent when purge is set.
+        """
+        if purge:
+            singletons = self.clean_singleton(threshold)
+        else:
+            singletons = list(self.headers.keys())
+            self.purged.clear()
+        self.minsup = threshold
+        return singletons
+
+    def mine_singleton(self,singleton,emit=None):
+        """
+        Mine the itemsets whose deepest item in the tree is the singleton,
+        growing conditional trees over its decayed conditional pattern base.
+        They are passed to emit when it is given, else returned in a dict.
+        """
         threshold = self.minsup
         frequent = {}
-        items = []
-        auxDict = {}
-        single = singleton        
-        node = self.headers[single]            
-        while node is not None:          
-            frequent[tuple(node.name)] = frequent.get(tuple(node.name),0) + node.support
-            items.clear()
-            auxDict.clear()                
-            if node.parent.parent is not None:                
-                current = node
-                suffix = (current.name,)
-                auxDict[current.name] = current.support
-                while current.parent.parent is not None:
-                    current = current.parent
-                    if not current.name in self.purged:
-                        items.append(current.name)
-                        auxDict[current.name] = current.support                
-                for i in range(1,len(items)+1):
-                    for subset in itertools.combinations(items,i):
-                            pattern = tuple(sorted(list(subset +suffix)))
-                            frequent[pattern] = frequent.get(pattern,0) + min([auxDict[x] for x in pattern])   
-            node = node.link                
-        #purge item with minsup smaller than Threshold
-        for key in tuple(frequent.keys()):
-            if frequent[key] < threshold:
-                del frequent[key]
+        if emit is None:
+            emit = frequent.__setitem__
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+            emit = stats.counted(emit)
+        base, support = self.conditional_base(singleton, set(self.purged))
+        if support >= threshold:
+            emit((singleton,), support)
+            conditionalTree(base, threshold, (), stats).mine((singleton,), emit)
+        if stats is not None:
+            stats.record('mine', time.perf_counter() - start)
         return frequent
 
-    def mine_itemsets(self, threshold,purge):
+    def reduced_order(self, singletons):
         """
-        Mine the frequent itemsets using headers        
+        Sort the singletons for closed or maximal mining, deepest first so
+        the supersets of an itemset are found before it.
         """
-        frequent = {}
-        items = []
-        auxDict = {}
-        #Todo check if the singleton meet the minsup criteria. 
-        if purge:
-            singletons = self.clean_singleton(threshold)       
+        if self.canonical:
+            singletons.sort(key=self.rank.get, reverse=True)
         else:
-            singletons = self.headers.keys()
-            purged = []
-        for single in singletons:
-            frequent.clear()                  
-            node = self.headers[single]            
-            while node is not None:          
-                frequent[tuple(node.name)] = frequent.get(tuple(node.name),0) + self.update_support(node,True) #node.support
-                items.clear()
-                auxDict.clear()                
-                if node.parent.parent is not None:
-                    current = node
-                    suffix = (current.name,)
-                    auxDict[current.name] = self.update_support(current,True) #current.support
-                    while current.parent.parent is not None:
-                        current = current.parent
-                        if not current.name in self.purged:
-                            items.append(current.name)
-                            auxDict[current.name] = self.update_support(current,True)             
-                    for i in range(1,len(items)+1):
-                        for subset in itertools.combinations(items,i):
-                            pattern = tuple(sorted(list(subset +suffix)))
-                            frequent[pattern] = frequent.get(pattern,0) + min([auxDict[x] for x in pattern])   
-                node = node.link                
-        #purge item with minsup smaller than Threshold
-            for key in tuple(frequent.keys()):
-                if frequent[key] < threshold:
-                    del frequent[key]
+            singletons.sort(key=lambda x: self.counts.get(x,0))
+        return singletons
+
+    def mine_reduced(self, singleton, mode, found, emit):
+        """
+        Emit the closed or maximal itemsets of a singleton that are not
+        contained in the ones found before.
+        """
+        threshold = self.minsup
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+            emit = stats.counted(emit)
+        base, support = self.conditional_base(singleton, set(self.purged))
+        if support < threshold:
+            pass
+        elif mode == 'closed':
+            pattern, closure = closed_pattern((singleton,), base, support)
+            if not found.subsumed(pattern, support):
+                emit(pattern, support)
+                found.add(pattern, support)
+                conditionalTree(base, threshold, closure, stats).mine_closed((singleton,) + closure, emit, found)
+        else:
+            tree = conditionalTree(base, threshold, (), stats)
+            if not found.subsumed((singleton,) + tuple(tree.order)):
+                tree.mine_maximal((singleton,), support, emit, found)
+        if stats is not None:
+            stats.record('mine', time.perf_counter() - start)
+
+    def mine_itemsets(self, threshold,purge,mode='all'):
+        """
+        Mine the frequent itemsets using headers        
+        mode - 'all' for every frequent itemset, 'closed' for those with no
+        superset of the same support, 'maximal' for those with no frequent
+        superset.  The closed and maximal itemsets are found by pruning the
+        search with the ones found before, so the items are mined deepest
+        first; they need the canonical order, see check_mode.
+        """
+        self.check_mode(mode)
+        singletons = self.select_singletons(threshold, purge)
+        if mode == 'all':
+            for single in singletons:
+                yield self.mine_singleton(single)
+            return
+        found = itemsetIndex()
+        for single in self.reduced_order(singletons):
+            frequent = {}
+            self.mine_reduced(single, mode, found, frequent.__setitem__)
             yield frequent
+
+    def check_mode(self, mode):
+        """
+        Raise ValueError for an unknown output mode, or for the closed and
+        maximal modes on a tree without the canonical order: the support
+        of an itemset is then split among the partitions of its items, and
+        closedness or maximality judged on a part of it means nothing.
+        """
+        if mode not in ('all', 'closed', 'maximal'):
+            raise ValueError("unknown output mode {}".format(mode))
+        if mode != 'all' and not self.canonical:
+            raise ValueError("{} mining needs the canonical order".format(mode))
+
+    def mine_to(self, sink, threshold, purge=True, mode='all', horizon=None):
+        """
+        Mine the frequent itemsets into sink, called with every (itemset,
+        support) as it is found instead of collecting them per singleton.
+        The modes are those of mine_itemsets.
+        horizon - mine the raw counts of the last horizon batches, read from
+        the tilted-time windows, instead of the decayed supports; the decayed
+        item counts do not bound them, so nothing is purged
+        """
+        self.check_mode(mode)
+        if horizon is not None:
+            if not self.window or horizon > self.window:
+                raise ValueError("horizon {} beyond the window of {} batches".format(horizon, self.window))
+            purge = False
+        self.horizon = horizon
+        try:
+            singletons = self.select_singletons(threshold, purge)
+            if mode == 'all':
+                for single in singletons:
+                    self.mine_singleton(single, sink)
+                return sink
+            found = itemsetIndex()
+            for single in self.reduced_order(singletons):
+                self.mine_reduced(single, mode, found, sink)
+            return sink
+        finally:
+            self.horizon = None
+
+    def mine_itemsets_multi(self, thresholds, purge=True, mode='all'):
+        """
+        Mine once at the lowest of the thresholds and return a
+        multiThreshold with the itemsets of each of them.  Filtering the
+        itemsets of a lower threshold gives those of a higher one, exactly,
+        for every itemset and for the closed ones; the maximal ones depend
+        on the threshold.  Without the canonical order an itemset is mined
+        once per partition, with a part of its support, so the tree must be
+        canonical.
+        """
+        if not self.canonical:
+            raise ValueError("multi-threshold mining needs the canonical order")
+        if mode not in ('all', 'closed'):
+            raise ValueError("no single pass mining in mode {}".format(mode))
+        records = []
+        self.mine_to(lambda pattern, support: records.append((pattern, support)), min(thresholds), purge, mode)
+        return multiThreshold(thresholds, records)
+
+    def mine_stream(self, threshold, purge=True, mode='all', maxsize=64):
+        """
+        Generator of the (itemset, support) records mined by a thread into a
+        bounded queue, which blocks the thread while the reader lags behind.
+        The tree must not be changed until the generator is exhausted or
+        closed.
+        """
+        records = queue.Queue(maxsize)
+        sink = queueSink(records)
+        failure = []
+        def produce():
+            try:
+                self.mine_to(sink, threshold, purge, mode)
+                sink.flush()
+            except Exception as error:
+                failure.append(error)
+            finally:
+                records.put(None)
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                chunk = records.get()
+                if chunk is None:
+                    break
+                yield from chunk
+            if len(failure) and not sink.closed:
+                raise failure[0]
+        finally:
+            sink.closed = True
+            while producer.is_alive():
+                try:
+                    records.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def mine_topk(self, k, min_len=1, max_len=None):
+        """
+        Mine the k itemsets of highest support, with no minimum support.
+        The header items are mined by decreasing decayed count so the
+        heap fills with strong itemsets early, and the threshold rises to
+        the weakest of the k, pruning the branches that cannot enter.
+        Returns (itemset, support) pairs, best first.
+        Only a canonical tree holds every transaction of an itemset under
+        its deepest item; otherwise each singleton only sees a part of the
+        support, so the ranking and its pruning would be wrong.
+        """
+        if not self.canonical:
+            raise ValueError("top-k mining needs the canonical order")
+        collector = topkCollector(k, min_len)
+        unit = self.unit
+        singletons = sorted(self.headers, key=lambda x: self.counts.get(x,0), reverse=True)
+        self.purged.clear()
+        for single in singletons:
+            # the decayed count bounds the support of every itemset under it
+            if self.counts.get(single,0) / unit < collector.threshold:
+                break
+            base, support = self.conditional_base(single, set())
+            if support < collector.threshold:
+                continue
+            collector.emit((single,), support)
+            if max_len is None or max_len > 1:
+                conditionalTree(base, collector.threshold, (), self.stats).mine((single,), collector.emit, collector, max_len)
+        return collector.result()
+
+    def mine_incremental(self, threshold, purge, refresh=False):
+        """
+        Mine the frequent itemsets reusing the results of the previous
+        mining for the items nothing was inserted under since.  The
+        itemsets of such an item only faded, so its cached supports are
+        faded too, which is exact as long as the threshold is not lower
+        than the cached one.  refresh mines everything again.
+        """
+        if refresh:
+            self.invalidate()
+        singletons = self.select_singletons(threshold, purge)
+        rBatch = self.root.batch - 1
+        for single in singletons:
+            entry = self.cache.get(single)
+            if entry is not None and single not in self.touched and threshold >= entry[1]:
+                batch, _, frequent = entry
+                decay = pow(self.fading, rBatch - batch)
+                yield {key: value * decay for key, value in frequent.items() if value * decay >= threshold}
+            else:
+                frequent = self.mine_singleton(single)
+                self.cache[single] = (rBatch, threshold, frequent)
+                self.touched.discard(single)
+                yield dict(frequent)
+
+    def snapshot(self):
+        """
+        Flatten the tree into the arrays and settings of a snapshot.  The
+        nodes are numbered in preorder, so a parent comes before its
+        children; this is the only part of a checkpoint done in place.
+        """
+        labels = list(self.headers)
+        ids = {x: i for i, x in enumerate(labels)}
+        for key in itertools.chain(self.counts, self.rank):
+            if key not in ids:
+                ids[key] = len(labels)
+                labels.append(key)
+        parent = array.array('q')
+        item = array.array('I')
+        support = array.array('d')
+        batch = array.array('q')
+        order = []
+        position = {}
+        stack = [(child, -1) for child in reversed(self.root.child_nodes())]
+        while len(stack):
+            node, up = stack.pop()
+            position[id(node)] = len(order)
+            order.append(node)
+            parent.append(up)
+            item.append(ids[node.name])
+            support.append(node.support)
+            batch.append(node.batch)
+            up = len(order) - 1
+            stack.extend((child, up) for child in reversed(node.child_nodes()))
+        link = array.array('q', [-1 if node.link is None else position[id(node.link)] for node in order])
+        heads = array.array('q', [-1] * len(labels))
+        tails = array.array('q', [-1] * len(labels))
+        for key, node in self.headers.items():
+            if node is None:
+                continue
+            heads[ids[key]] = position[id(node)]
+            tails[ids[key]] = position[id(self.tails[key])]
+        counts = array.array('d', [self.counts.get(x, float('nan')) for x in labels])
+        rank = array.array('q', [self.rank.get(x, -1) for x in labels])
+        settings = {'labels': labels, 'fading': self.fading, 'lazy': self.lazy,
+                    'landmark': self.landmark, 'weight': self.weight, 'unit': self.unit,
+                    'canonical': self.canonical, 'rerank': self.rerank, 'epsilon': self.epsilon,
+                    'prune_every': self.prune_every, 'max_nodes': self.max_nodes, 'error': self.error, 'total': self.total,
+                    'root': [self.root.name, self.root.support, self.root.batch]}
+        return [parent, support, batch, link, heads, tails, counts, rank, item], settings
+
+    def save(self, path, background=False):
+        """
+        Write a snapshot of the tree to path, through a temporary file
+        replaced at the end so a crash never leaves half a checkpoint.
+        With background the file is written by a thread, which is
+        returned, while the tree goes on changing.
+        """
+        sections, settings = self.snapshot()
+        if not background:
+            write_snapshot(path, sections, settings)
+            return None
+        writer = threading.Thread(target=write_snapshot, args=(path, sections, settings))
+        writer.start()
+        return writer
+
+    @classmethod
+    def load(cls, path):
+        """
+        Rebuild a tree from a snapshot written by save.  The mining cache
+        is not saved, the first incremental mining mines every item, nor are
+        the tilted-time windows, which start again empty.
+        """
+        with open(path, 'rb') as source:
+            sections, settings = read_snapshot(source.read())
+        parent, support, batch, link, heads, tails, counts, rank, item = [x.tolist() for x in sections]
+        labels = settings['labels']
+        tree = cls([], 1, settings['fading'], settings['root'][0], settings['root'][1],
+                   settings['canonical'], settings['rerank'], settings['lazy'], settings['epsilon'],
+                   settings['prune_every'], settings['max_nodes'])
+        for key in ('landmark', 'weight', 'unit', 'error'):
+            setattr(tree, key, settings[key])
+        tree.total = settings.get('total', 0)
+        tree.root.batch = settings['root'][2]
+        tree.counts = {labels[i]: x for i, x in enumerate(counts) if x == x}
+        tree.rank = {labels[i]: x for i, x in enumerate(rank) if x >= 0}
+        root = tree.root
+        nodes = [treeNode(labels[x], 0, None) for x in item]
+        for node, up, value, last in zip(nodes, parent, support, batch):
+            node.support = value
+            node.batch = last
+            up = root if up < 0 else nodes[up]
+            node.parent = up
+            node.depth = up.depth + 1
+            if len(up.children):
+                up.children.append(node)
+            else:
+                up.children = [node]
+        for node in itertools.chain((root,), nodes):
+            if len(node.children) > CHILD_INDEX_THRESHOLD:
+                node.children = {child.name: child for child in node.children}
+        for i, next in enumerate(link):
+            if next >= 0:
+                nodes[i].link = nodes[next]
+        for i, head in enumerate(heads):
+            if head >= 0:
+                tree.headers[labels[i]] = nodes[head]
+                tree.tails[labels[i]] = nodes[tails[i]]
+        tree.nodes = len(nodes)
+        return tree
+
+    def enable_stats(self, log_every=0):
+        """
+        Start counting the work of the tree in a treeStats, printing a
+        line of it every log_every batches (0 never prints).
+        """
+        self.stats = treeStats(log_every)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    def invalidate(self):
+        """
+        Drop the cached mining results.
+        """
+        self.cache.clear()
+        self.touched.clear()
       
+SNAPSHOT_MAGIC = b'TFTS'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct('<4sIQQQ?7x') # magic, version, nodes, labels, settings offset, little endian
+SNAPSHOT_TYPES = 'qdqqqqdqI' # parent, support, batch, link of the nodes, heads, tails, counts, ranks of the labels, item of the nodes
+
+def write_snapshot(path, sections, settings):
+    """
+    Write the arrays of a snapshot after its header, each one starting on
+    a multiple of 8 bytes, then the settings as JSON.
+    """
+    nodes = len(sections[0])
+    labels = len(settings['labels'])
+    size = SNAPSHOT_HEADER.size
+    for section in sections:
+        size += (len(section) * section.itemsize + 7) // 8 * 8
+    with open(path + '.tmp', 'wb') as output:
+        output.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, nodes, labels, size, sys.byteorder == 'little'))
+        for section in sections:
+            section.tofile(output)
+            output.write(bytes(-len(section) * section.itemsize % 8))
+        output.write(json.dumps(settings).encode())
+    os.replace(path + '.tmp', path)
+
+def read_snapshot(buffer, copy=True):
+    """
+    Split a snapshot into its arrays and settings.  The arrays are copies,
+    or memoryviews over the buffer when copy is false.
+    """
+    magic, version, nodes, labels, offset, little = SNAPSHOT_HEADER.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("not a version {} tree snapshot".format(SNAPSHOT_VERSION))
+    swap = little != (sys.byteorder == 'little')
+    view = memoryview(buffer)
+    sections = []
+    start = SNAPSHOT_HEADER.size
+    for index, code in enumerate(SNAPSHOT_TYPES):
+        length = labels if 4 <= index < 8 else nodes
+        size = length * array.array(code).itemsize
+        if copy or swap:
+            section = array.array(code, bytes(view[start:start + size]))
+            if swap:
+                section.byteswap()
+        else:
+            section = view[start:start + size].cast(code)
+        sections.append(section)
+        start += (size + 7) // 8 * 8
+    settings = json.loads(bytes(view[offset:]).decode())
+    return sections, settings
+
+class treeView (Tree):
+    """
+    Read-only tree over a memory-mapped snapshot.  The mining methods of
+    Tree walk the arrays of the file instead of nodes, so nothing is
+    rebuilt.  A view answers mine_to, mine_itemsets, mine_itemsets_thread,
+    mine_itemsets_multi, mine_stream, mine_topk, support, supports and
+    decayed_transactions; it has no nodes to insert into, prune, rebuild
+    or save, and no cache for mine_incremental.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            self.mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        sections, settings = read_snapshot(self.mapped, False)
+        self.parent, self.node_supports, self.batch, self.link, heads, tails, counts, rank, self.item = sections
+        self.labels = settings['labels']
+        self.fading = settings['fading']
+        self.lazy = settings['lazy']
+        self.unit = settings['unit']
+        self.canonical = settings['canonical']
+        self.error = settings['error']
+        self.total = settings.get('total', 0)
+        self.last = settings['root'][2] - 1
+        self.headers = {self.labels[i]: x for i, x in enumerate(heads) if x >= 0}
+        self.counts = {self.labels[i]: x for i, x in enumerate(counts) if x == x}
+        self.rank = {self.labels[i]: x for i, x in enumerate(rank) if x >= 0}
+        self.nodes = len(self.parent)
+        self.minsup = 0
+        self.purged = []
+        self.stats = None
+        self.window = 0 # snapshots do not keep the tilted-time windows
+        self.horizon = None
+
+    def close(self):
+        for section in (self.parent, self.node_supports, self.batch, self.link, self.item):
+            section.release()
+        self.mapped.close()
+
+    def node_support(self, index):
+        """
+        Decayed support of a node at the last batch.
+        """
+        if self.lazy:
+            return self.node_supports[index] / self.unit
+        return self.node_supports[index] * pow(self.fading, self.last - self.batch[index])
+
+    def conditional_base(self, item, purged):
+        base = []
+        total = 0
+        labels = self.labels
+        parent = self.parent
+        node = self.headers[item]
+        while node >= 0:
+            weight = self.node_support(node)
+            total += weight
+            path = []
+            current = parent[node]
+            while current >= 0:
+                name = labels[self.item[current]]
+                if name not in purged:
+                    path.append(name)
+                current = parent[current]
+            if len(path):
+                base.append((path, weight))
+            node = self.link[node]
+        return base, total
+
+    def supports(self, itemsets):
+        """
+        Decayed supports of many itemsets, from the conditional bases of
+        their items; the nodes of a view have no depth nor objects.
+        """
+        result = []
+        for itemset in itemsets:
+            itemset = set(itemset)
+            support = 0
+            if len(itemset) and all(x in self.headers for x in itemset):
+                for item in itemset:
+                    rest = itemset - {item}
+                    base, total = self.conditional_base(item, ())
+                    support += total if not len(rest) else sum(weight for path, weight in base if rest.issubset(path))
+            result.append(support)
+        return result
+
+    def chain_length(self, item):
+        length = 0
+        node = self.headers[item]
+        while node >= 0:
+            length += 1
+            node = self.link[node]
+        return length
+
+    def fade_nodes(self):
+        # the supports are faded as they are read
+        pass
+
+    def mine_incremental(self, threshold, purge, refresh=False):
+        raise ValueError("a tree view keeps no cache for incremental mining")
+
+# tree inherited by the forked mining workers
+sharedTree = None
+
+def mine_shared_singleton(singleton):
+    """
+    Mine one header item of the tree inherited from the parent process.
+    """
+    return sharedTree.mine_singleton(singleton)
+
+# binary dataset: header, transaction offsets, item ids and the item labels
+BINARY_MAGIC = b'TFTD'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sIQQQ?') # magic, version, transactions, items, labels offset, little endian
+PATTERN_MAGIC = b'TFTP'
+PATTERN_VERSION = 1
+PATTERN_HEADER = struct.Struct('<4sIQQ?') # magic, version, itemsets, labels offset, little endian
+PATTERN_RECORD = struct.Struct('=Id') # length, support, in the byte order of the writer
+
+class ItemDictionary (object):
+    """
+    Map the item labels to dense integer ids and back.
+    """
+    def __init__(self, labels=()):
+        self.labels = []
+        self.ids = {}
+        for label in labels:
+            self.encode(label)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def encode(self, label):
+        """
+        Return the id of a label, giving the next id to a new one.
+        """
+        id = self.ids.get(label)
+        if id is None:
+            id = len(self.labels)
+            self.ids[label] = id
+            self.labels.append(label)
+        return id
+
+    def encode_transaction(self, transaction):
+        ids = self.ids
+        return [ids[x] if x in ids else self.encode(x) for x in transaction]
+
+    def decode(self, id):
+        return self.labels[id]
+
+    def decode_pattern(self, pattern):
+        """
+        Translate an itemset of ids to a sorted tuple of labels.
+        """
+        return tuple(sorted(self.labels[x] for x in pattern))
+
+    def decode_patterns(self, frequent):
+        """
+        Translate the keys of a mined dictionary.
+        """
+        return {self.decode_pattern(key): value for key, value in frequent.items()}
+
+class EclatMiner (object):
+    """
+    Vertical miner over the same stream as Tree.  Every batch keeps, for
+    each item, the bitset of the transactions of the batch holding it as
+    a Python int; an itemset is mined by and-ing the bitsets of its items
+    batch by batch, and its support is the popcount of each batch weighted
+    by the fading of its age.
+    """
+    def __init__(self, fading, min_weight=0):
+        """
+        fading - fading factor per batch, as for Tree
+        min_weight - the batches whose fading weight falls below it are
+        dropped (0 keeps every batch)
+        """
+        self.fading = fading
+        self.min_weight = min_weight
+        self.batch = 0 # number of batches inserted
+        self.batches = [] # (batch number, item -> bitset) of the kept batches
+        self.counts = {} # decayed count of every item read, at the current batch
+        self.total = 0 # decayed count of the transactions read, at the current batch
+        self.error = 0 # decayed support dropped with the old batches
+        self.minsup = 0
+        self.purged = []
+
+    @property
+    def bitsets(self):
+        return sum(len(bits) for batch, bits in self.batches)
+
+    def insert_transactions(self, transactions, threshold):
+        """
+        Add a batch.  An item of a transaction is kept when its decayed
+        count, this transaction included, reaches the threshold, which is
+        the admission of Tree.insert_transactions.
+        """
+        counts = self.counts
+        for key in counts:
+            counts[key] *= self.fading
+        self.total = self.total * self.fading + len(transactions)
+        tids = {}
+        for tid, transaction in enumerate(transactions):
+            for item in transaction:
+                count = counts.get(item,0) + 1
+                counts[item] = count
+                if count >= threshold:
+                    tids.setdefault(item, []).append(tid)
+        size = (len(transactions) + 7) // 8
+        bits = {}
+        for item, positions in tids.items():
+            buffer = bytearray(size)
+            for tid in positions:
+                buffer[tid >> 3] |= 1 << (tid & 7)
+            bits[item] = int.from_bytes(buffer, 'little')
+        self.batches.append((self.batch, bits))
+        self.batch += 1
+        self.error *= self.fading
+        if self.min_weight:
+            while len(self.batches) and pow(self.fading, self.batch - 1 - self.batches[0][0]) < self.min_weight:
+                batch, dropped = self.batches.pop(0)
+                self.error += pow(self.fading, self.batch - 1 - batch) * max([x.bit_count() for x in dropped.values()], default=0)
+
+    def decayed_transactions(self):
+        return self.total
+
+    def weights(self):
+        return [pow(self.fading, self.batch - 1 - batch) for batch, bits in self.batches]
+
+    def select_singletons(self, threshold, purge):
+        """
+        The items with their bitsets per batch and decayed supports, least
+        frequent first, without the ones below the threshold.
+        """
+        weights = self.weights()
+        vectors = {}
+        for index, (batch, bits) in enumerate(self.batches):
+            for item, value in bits.items():
+                vectors.setdefault(item, [0] * len(weights))[index] = value
+        singletons = []
+        self.purged = []
+        for item, vector in vectors.items():
+            support = sum(w * x.bit_count() for w, x in zip(weights, vector))
+            if support >= threshold or not purge:
+                singletons.append((support, item, vector))
+            else:
+                self.purged.append(item)
+        singletons.sort(key=lambda x: x[0])
+        self.minsup = threshold
+        return singletons
+
+    def mine_class(self, prefix, members, weights, emit):
+        """
+        Mine an equivalence class: every member is the prefix plus one
+        item, with its support and bitsets.
+        """
+        for index in range(len(members)):
+            self.mine_member(prefix, members, index, weights, emit)
+
+    def mine_member(self, prefix, members, index, weights, emit):
+        """
+        Emit a member of a class and mine the class of its joins with the
+        members after it.
+        """
+        threshold = self.minsup
+        support, item, vector = members[index]
+        pattern = prefix + (item,)
+        emit(tuple(sorted(pattern)), support)
+        extensions = []
+        for count, other, bits in members[index+1:]:
+            joined = [a & b for a, b in zip(vector, bits)]
+            count = sum(w * x.bit_count() for w, x in zip(weights, joined))
+            if count >= threshold:
+                extensions.append((count, other, joined))
+        if len(extensions):
+            self.mine_class(pattern, extensions, weights, emit)
+
+    def mine_to(self, sink, threshold, purge=True, mode='all'):
+        """
+        Mine the frequent itemsets into sink, as Tree.mine_to.
+        """
+        if mode != 'all':
+            raise ValueError("the vertical miner only mines every itemset")
+        singletons = [x for x in self.select_singletons(threshold, purge) if x[0] >= threshold]
+        self.mine_class((), singletons, self.weights(), sink)
+        return sink
+
+    def mine_itemsets(self, threshold, purge, mode='all'):
+        """
+        Mine the frequent itemsets, one dict per item with the itemsets
+        whose least frequent item it is.
+        """
+        if mode != 'all':
+            raise ValueError("the vertical miner only mines every itemset")
+        singletons = [x for x in self.select_singletons(threshold, purge) if x[0] >= threshold]
+        weights = self.weights()
+        for index in range(len(singletons)):
+            frequent = {}
+            self.mine_member((), singletons, index, weights, frequent.__setitem__)
+            yield frequent
+
+class countSink (object):
+    """
+    Sink that only counts the mined itemsets.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, pattern, support):
+        self.count += 1
+
+class queueSink (object):
+    """
+    Sink that puts the itemsets in a bounded queue, in chunks of records.
+    """
+    def __init__(self, queue, chunk=1024):
+        self.queue = queue
+        self.chunk = chunk
+        self.records = []
+        self.closed = False
+
+    def __call__(self, pattern, support):
+        self.records.append((pattern, support))
+        if len(self.records) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if self.closed:
+            raise RuntimeError("the reader of the queue is gone")
+        if len(self.records):
+            self.queue.put(self.records)
+            self.records = []
+
+class patternWriter (object):
+    """
+    Sink that writes the itemsets to a file.  The records are formatted
+    into a buffer written out in one call every chunk records.
+    items - ItemDictionary the itemsets are decoded with, if any
+    """
+    def __init__(self, path, items=None, chunk=1 << 14):
+        self.output = open(path, 'wb')
+        self.items = items
+        self.chunk = chunk
+        self.records = []
+        self.count = 0
+
+    def __call__(self, pattern, support):
+        self.records.append((pattern, support))
+        if len(self.records) >= self.chunk:
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def labels(self, pattern):
+        if self.items is None:
+            return pattern
+        return self.items.decode_pattern(pattern)
+
+    def flush(self):
+        self.output.write(self.format(self.records))
+        self.count += len(self.records)
+        self.records = []
+
+    def close(self):
+        if not self.output.closed:
+            self.flush()
+            self.output.close()
+
+class csvWriter (patternWriter):
+    """
+    One itemset per line: its items separated by spaces, then its support.
+    """
+    def format(self, records):
+        return ''.join('{},{!r}\n'.format(' '.join(map(str, self.labels(pattern))), support)
+                       for pattern, support in records).encode()
+
+class jsonlWriter (patternWriter):
+    """
+    One JSON object per line, with the itemset and its support.
+    """
+    def format(self, records):
+        return ''.join(json.dumps({'itemset': list(self.labels(pattern)), 'support': support}) + '\n'
+                       for pattern, support in records).encode()
+
+class binaryWriter (patternWriter):
+    """
+    The header, then for every itemset its length (uint32), its support
+    (float64) and its item ids (uint32), then the labels of the ids as a
+    JSON list.  The ids are those of items, else the labels are interned
+    as they are written.
+    """
+    def __init__(self, path, items=None, chunk=1 << 14):
+        patternWriter.__init__(self, path, items, chunk)
+        self.dictionary = items if items is not None else ItemDictionary()
+        self.output.write(PATTERN_HEADER.pack(PATTERN_MAGIC, PATTERN_VERSION, 0, 0, sys.byteorder == 'little'))
+
+    def format(self, records):
+        buffer = bytearray()
+        ids = array.array('I')
+        encode = self.dictionary.encode
+        for pattern, support in records:
+            buffer += PATTERN_RECORD.pack(len(pattern), support)
+            if self.items is None:
+                ids.extend(encode(x) for x in pattern)
+            else:
+                ids.extend(pattern)
+            buffer += ids.tobytes()
+            del ids[:]
+        return bytes(buffer)
+
+    def close(self):
+        if not self.output.closed:
+            self.flush()
+            labels_offset = self.output.tell()
+            self.output.write(json.dumps(self.dictionary.labels).encode())
+            self.output.seek(0)
+            self.output.write(PATTERN_HEADER.pack(PATTERN_MAGIC, PATTERN_VERSION, self.count, labels_offset, sys.byteorder == 'little'))
+            self.output.close()
+
+def open_writer(path, items=None):
+    """
+    The writer of a file by its extension: .csv, .jsonl or binary.
+    """
+    if path.endswith('.csv'):
+        return csvWriter(path, items)
+    if path.endswith('.jsonl'):
+        return jsonlWriter(path, items)
+    return binaryWriter(path, items)
+
+def read_patterns(path):
+    """
+    Read back the (itemset, support) records of a binary pattern file,
+    with the itemsets as tuples of labels.
+    """
+    with open(path, 'rb') as source:
+        data = source.read()
+    magic, version, count, labels_offset, little = PATTERN_HEADER.unpack_from(data, 0)
+    if magic != PATTERN_MAGIC or version != PATTERN_VERSION:
+        raise ValueError("not a version {} pattern file".format(PATTERN_VERSION))
+    labels = json.loads(data[labels_offset:].decode())
+    order = '<' if little else '>'
+    record = struct.Struct(order + 'Id')
+    position = PATTERN_HEADER.size
+    for _ in range(count):
+        length, support = record.unpack_from(data, position)
+        position += record.size
+        ids = struct.unpack_from(order + str(length) + 'I', data, position)
+        position += 4*length
+        yield tuple(labels[x] for x in ids), support
+
+def transaction_format(lines):
+    """
+    Guess the format of a file from the fields of its first lines: the
+    'id len tid items...' layout of the IBM generator when the length
+    field matches on every one of them, otherwise a plain basket with the
+    items of a transaction on its line.  A numeric basket line can look
+    like a quest one, a few of them in a row hardly do.
+    """
+    for fields in lines:
+        if not (len(fields) >= 3 and fields[0].isdigit() and fields[1].isdigit() and int(fields[1]) == len(fields) - 3):
+            return 'basket'
+    return 'quest' if len(lines) else 'basket'
+
+def parse_transactions (readline,limit,fmt,items):
+    '''
+    Split the lines returned by readline into transactions.
+    '''
+    count = 0
+    lines = (line.decode().split() for line in iter(readline, b''))
+    lines = (fields for fields in lines if len(fields))
+    if fmt == 'auto':
+        sample = list(itertools.islice(lines, FORMAT_SAMPLE))
+        fmt = transaction_format(sample)
+        lines = itertools.chain(sample, lines)
+    skip = 3 if fmt == 'quest' else 0
+    for fields in lines:
+        if items is None:
+            yield fields[skip:]
+        else:
+            yield items.encode_transaction(fields[skip:])
+        count += 1
+        if count == limit:
+            break
+
+def read_binary_transactions (buffer,limit,items):
+    '''
+    Read the transactions of a binary dataset held in buffer.
+    The ids of the file are translated to the ids of items, or to the
+    labels when no dictionary is given.
+    '''
+    magic, version, transactions, size, labels_offset, little = BINARY_HEADER.unpack_from(buffer, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("not a version {} binary dataset".format(BINARY_VERSION))
+    start = BINARY_HEADER.size
+    view = memoryview(buffer)
+    if little == (sys.byteorder == 'little'):
+        offsets = view[start:start + 8*(transactions+1)].cast('Q')
+        ids = view[start + 8*(transactions+1):labels_offset].cast('I')
+    else:
+        offsets = array.array('Q', view[start:start + 8*(transactions+1)])
+        ids = array.array('I', view[start + 8*(transactions+1):labels_offset])
+        offsets.byteswap()
+        ids.byteswap()
+    labels = json.loads(bytes(view[labels_offset:]).decode())
+    if items is None:
+        translate = labels
+    else:
+        translate = [items.encode(label) for label in labels]
+    identity = translate == list(range(len(translate)))
+    if limit is not None:
+        transactions = min(transactions, limit)
+    try:
+        for index in range(transactions):
+            transaction = ids[offsets[index]:offsets[index+1]].tolist()
+            if not identity:
+                transaction = [translate[x] for x in transaction]
+            yield transaction
+    finally:
+        if isinstance(offsets, memoryview):
+            offsets.release()
+            ids.release()
+        view.release()
+
+def read_transactions (data,limit=None,fmt='auto',use_mmap=False,items=None):
+    '''
+    Read the transactions of a file one at a time, stopping after limit.
+    input - datapath, limit, format ('auto', 'quest', 'basket' or 'binary'),
+    whether the file is memory-mapped instead of read through a buffer and
+    an optional ItemDictionary to read the items as integer ids
+    output - generator of transactions
+    '''
+    if limit is not None and limit <= 0:
+        return
+    with open(data, 'rb') as source:
+        if fmt == 'auto' and source.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+            fmt = 'binary'
+        source.seek(0)
+        if fmt == 'binary':
+            # binary datasets are always mapped, there is nothing to parse
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from read_binary_transactions(mapped,limit,items)
+        elif use_mmap and os.fstat(source.fileno()).st_size > 0:
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from parse_transactions(mapped.readline,limit,fmt,items)
+        else:
+            yield from parse_transactions(source.readline,limit,fmt,items)
+
+def read_batches (data,batchSize,limit=None,fmt='auto',use_mmap=False,items=None):
+    '''
+    Group the transactions of a file in batches as they are read.
+    output - generator of lists of batchSize transactions
+    '''
+    batch = []
+    for transaction in read_transactions(data,limit,fmt,use_mmap,items):
+        batch.append(transaction)
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if len(batch):
+        yield batch
+
+def convert_dataset (data,target,fmt='auto',limit=None):
+    '''
+    Write a text dataset in the binary format: the header, the offsets of
+    the transactions (uint64), their item ids (uint32) and the item labels
+    as a JSON list.
+    output - the ItemDictionary of the dataset
+    '''
+    items = ItemDictionary()
+    offsets = array.array('Q', [0])
+    with open(target + '.items', 'wb') as spool:
+        ids = array.array('I')
+        for transaction in read_transactions(data,limit,fmt,False,items):
+            ids.extend(transaction)
+            offsets.append(offsets[-1] + len(transaction))
+            if len(ids) >= 1 << 20:
+                ids.tofile(spool)
+                ids = array.array('I')
+        ids.tofile(spool)
+    transactions = len(offsets) - 1
+    labels_offset = BINARY_HEADER.size + 8*len(offsets) + 4*offsets[-1]
+    with open(target, 'wb') as output:
+        output.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, transactions, offsets[-1], labels_offset, sys.byteorder == 'little'))
+        offsets.tofile(output)
+        with open(target + '.items', 'rb') as spool:
+            shutil.copyfileobj(spool, output)
+        output.write(json.dumps(items.labels).encode())
+    os.remove(target + '.items')
+    return items
+
 def loadData (data,limit):
     '''
     Load the data into a a list for transactions
     input - datapath
     output - list of transactions
     '''
-    result = []
-    data = open(data).readlines()
-    for transaction in data:
-        transaction = transaction.split()[3:]
-        result.append(transaction)
-    return result[:limit]
+    return list(read_transactions(data,limit))
 
 def printTransactions(dataset,threads):
     if type(dataset) is list:
@@ -350,27 +2162,47 @@ def printTransactions(dataset,threads):
 
 
 
+USAGE = "handler.py -d <database> -p <preMinSup> -m <minSup> -s <sampleSize> -b <batchSize> -t <True/False> [-w <workers>] [-k <mineEvery>] [-c <rerank>] [-l] [-e <epsilon>] [-n <pruneEvery>] [-x <maxNodes>] [-f <quest/basket/binary>] [-M] [-i] [-o <all/closed/maximal>] [-O <output.csv/.jsonl/.bin>] [-S <minSup,minSup,...>] [-C <checkpoint>] [-R <snapshot>] [-v <minWeight>] [-P <statsEvery>] [-H <batches,batches,...>]"
+
 def main(argv):
-    sys.setrecursionlimit(1000000)
     plaintext_database = ''
     preMinSup = 0
     minSup = 0
     sampleSize = 0
     threads = False
+    workers = os.cpu_count()
+    mineEvery = 0
     batchSize = 1
     fading  = 0.6
+    canonical = False
+    rerank = 0
+    lazy = False
+    epsilon = 0
+    pruneEvery = 0
+    maxNodes = 0
+    fmt = 'auto'
+    useMmap = False
+    items = None
+    mode = 'all'
+    output = ''
+    sweep = []
+    checkpoint = ''
+    restore = ''
+    vertical = None
+    statsEvery = None
+    horizons = []
     try:
-        opts, args = getopt.getopt(argv, "hd:p:m:s:b:t:")
+        opts, args = getopt.getopt(argv, "hd:p:m:s:b:t:w:k:c:le:n:x:f:Mio:O:S:C:R:v:P:H:")
     except getopt.GetoptError:
-        print("handler.py -d <database> -p <preMinSup> -m <minSup> -s <sampleSize> -b <batchSize> -t <True/False>")
+        print(USAGE)
         sys.exit(2)
-    if len(opts) < 6:
+    if not {'-d', '-p', '-m', '-s', '-b'} <= {opt for opt, arg in opts}:
         print("Please provide all parameters needed.")
-        print("handler.py -d <database> -p <preMinSup> -m <minSup> -s <sampleSize> -b <batchSize> -t <True/False>")
+        print(USAGE)
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
-            print("handler.py -d <database> -p <preMinSup> -m <minSup> -s <sampleSize> -t <threads>")
+            print(USAGE)
             sys.exit()
         elif opt == '-d':
             plaintext_database = arg
@@ -383,42 +2215,144 @@ def main(argv):
         elif opt == '-b':
             batchSize = int(arg)
         elif opt == '-t':
-            threads = bool(arg)
+            threads = arg.lower() not in ('false', 'no', '0')
+        elif opt == '-w':
+            workers = int(arg)
+            threads = workers > 0
+        elif opt == '-k':
+            mineEvery = int(arg)
+        elif opt == '-c':
+            canonical = True
+            rerank = int(arg)
+        elif opt == '-l':
+            lazy = True
+        elif opt == '-e':
+            epsilon = float(arg)
+        elif opt == '-n':
+            pruneEvery = int(arg)
+        elif opt == '-x':
+            maxNodes = int(arg)
+        elif opt == '-f':
+            fmt = arg
+        elif opt == '-M':
+            useMmap = True
+        elif opt == '-i':
+            items = ItemDictionary()
+        elif opt == '-o':
+            mode = arg
+        elif opt == '-O':
+            output = arg
+        elif opt == '-S':
+            sweep = [float(x) for x in arg.split(',')]
+        elif opt == '-C':
+            checkpoint = arg
+        elif opt == '-R':
+            restore = arg
+        elif opt == '-v':
+            vertical = float(arg)
+        elif opt == '-P':
+            statsEvery = int(arg)
+        elif opt == '-H':
+            horizons = [int(x) for x in arg.split(',')]
     
-    test = loadData(plaintext_database,sampleSize)
-    batches = [test[i:i + batchSize] for i in range(0, len(test), batchSize)]
-    tree = Tree([], 1,fading,'None', 0)
+    if vertical is not None and {'-w', '-k', '-c', '-l', '-e', '-n', '-x', '-o', '-S', '-C', '-R', '-P', '-H'} & {opt for opt, arg in opts}:
+        print("The vertical miner only takes -d -p -m -s -b -f -M -i -O.")
+        sys.exit(2)
+    if vertical is not None:
+        threads = False
+    if mode != 'all' and not canonical and not restore:
+        print("-o {} needs the canonical order (-c).".format(mode))
+        sys.exit(2)
+    if sweep and not canonical and not restore:
+        print("-S needs the canonical order (-c).")
+        sys.exit(2)
+
     preMinSup *= batchSize
+    epsilon *= batchSize
+    if vertical is not None:
+        tree = EclatMiner(fading, vertical)
+    elif restore:
+        tree = Tree.load(restore)
+    else:
+        tree = Tree([], 1,fading,'None', 0,canonical,rerank,lazy,epsilon,pruneEvery,maxNodes)
+    if horizons:
+        tree.window = max(horizons)
     minSup *= batchSize
+    sweep = [x * batchSize for x in sweep]
+    if statsEvery is not None:
+        tree.enable_stats(statsEvery)
 
     print("TimeFading Tree")
     print("PreMinSup- {}".format(preMinSup))
     print("Batch Size - {} ".format(batchSize))
     print("Sample Size - {}".format(sampleSize))
     start_time = time.time()
-    for index in range(len(batches)):        
-        tree.insert_transactions(batches[index],preMinSup)
-        if ((index+1) % 10) == 0 :
-            print("{}--- {:.4f} seconds ---".format(index+1, (time.time() - start_time)))
+    batches = read_batches(plaintext_database,batchSize,sampleSize,fmt,useMmap,items)
+    writer = None
+    for done, batch in enumerate(batches, 1):
+        tree.insert_transactions(batch,preMinSup)
+        if done % 10 == 0:
+            print("{}--- {:.4f} seconds ---".format(done, (time.time() - start_time)))
+            if checkpoint:
+                if writer is not None:
+                    writer.join()
+                writer = tree.save(checkpoint, True)
+        if mineEvery and done % mineEvery == 0:
+            mine_time = time.time()
+            count = sum(len(x) for x in tree.mine_incremental(minSup, True))
+            print("{}--- Mined {} itemsets incrementally in {:.4f} seconds ---".format(done, count, time.time() - mine_time))
+    if writer is not None:
+        writer.join()
+    if vertical is not None:
+        print("Bitsets - {} in {} batches".format(tree.bitsets, len(tree.batches)))
+    else:
+        print("Nodes - {}".format(tree.nodes))
     #tree.root.display()
 
     start_time = time.time()
     print("Mining Sequential singleton Purge")
     print("Minsup - {}".format(minSup))
-    printTransactions(tree.mine_itemsets(minSup, False),False)
+    print(tree.mine_to(countSink(), minSup, False, mode).count)
     print("{}--- {} seconds ---".format("Mine with sequential code", (time.time() - start_time)))
     print()
     start_time = time.time()
     print("Mining Sequential Purge")
     print("Minsup - {}".format(minSup))
-    printTransactions(tree.mine_itemsets(minSup, True),False)
-    print("{}--- {} seconds ---".format("Mine with sequential code", (time.time() - start_time)))
-    print("Mining with threads")
-    print("Minsup - {}".format(minSup))
-    print()
-    start_time = time.time()
-    printTransactions(tree.mine_itemsets_threadF(minSup),True)
-    print("{}--- {} seconds ---".format("Mine with Parallel code", (time.time() - start_time)))
+    print(tree.mine_to(countSink(), minSup, True, mode).count)
+    sequential = time.time() - start_time
+    print("{}--- {} seconds ---".format("Mine with sequential code", sequential))
+    if sweep:
+        print()
+        start_time = time.time()
+        result = tree.mine_itemsets_multi(sweep, True, mode)
+        for threshold in sweep:
+            print("Mined {} - Minsup {}".format(result.count(threshold), threshold))
+        print("{}--- {} seconds ---".format("Mine every minsup at once", (time.time() - start_time)))
+    if horizons:
+        print()
+        for horizon in horizons:
+            start_time = time.time()
+            count = tree.mine_to(countSink(), minSup * horizon, False, mode, horizon).count
+            print("Mined {} - last {} batches - Minsup {} --- {:.4f} seconds ---".format(count, horizon, minSup * horizon, time.time() - start_time))
+    if output:
+        start_time = time.time()
+        with open_writer(output, items) as writer:
+            tree.mine_to(writer, minSup, True, mode)
+        print("{}--- Wrote {} itemsets in {:.4f} seconds ---".format(output, writer.count, time.time() - start_time))
+    if threads and mode == 'all':
+        # the closed and maximal itemsets are pruned with the ones found
+        # before, which the workers do not share
+        print()
+        print("Mining with threads")
+        print("Minsup - {}".format(minSup))
+        print("Workers - {}".format(workers))
+        start_time = time.time()
+        printTransactions(tree.mine_itemsets_thread(minSup, True, workers),False)
+        parallel = time.time() - start_time
+        print("{}--- {} seconds ---".format("Mine with Parallel code", parallel))
+        print("Speedup - {:.2f}".format(sequential / parallel))
+    if statsEvery is not None:
+        print(tree.stats.json())
    
 
 if __name__ == "__main__":
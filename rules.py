@@ -0,0 +1,316 @@
+import sys
+import os
+import gc
+import time
+import heapq
+import getopt
+import multiprocessing
+
+from handler import Tree, EclatMiner, read_batches
+
+USAGE = "rules.py -d <database> -p <preMinSup> -m <minSup> -s <sampleSize> -b <batchSize> -r <minConf> [-k <topRules>] [-y <lift/confidence>] [-w <workers>] [-c <rerank>] [-l] [-f <quest/basket/binary>] [-M] [-v <minWeight>]"
+
+class ruleCollector (object):
+    """
+    Bounded min-heap of the k best rules found so far, by lift or by
+    confidence.  Once it is full its threshold is the score of the
+    weakest rule.
+    """
+    def __init__(self, k, key='lift'):
+        if key not in ('lift', 'confidence'):
+            raise ValueError("unknown rule ranking {}".format(key))
+        self.k = k
+        self.key = key
+        self.heap = []
+        self.threshold = 0
+
+    @property
+    def floor(self):
+        """
+        Confidence under which no rule can enter: the confidence of a rule
+        only falls as its consequent grows, its lift does not.
+        """
+        return self.threshold if self.key == 'confidence' else 0
+
+    def emit(self, rule):
+        score = rule[4] if self.key == 'lift' else rule[3]
+        if score is None:
+            return
+        entry = (score,) + rule
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+            if len(self.heap) == self.k:
+                self.threshold = self.heap[0][0]
+        elif score > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+            self.threshold = self.heap[0][0]
+
+    def merge(self, entries):
+        for entry in entries:
+            self.emit(entry[1:])
+
+    def result(self):
+        """
+        The rules, best first.
+        """
+        return [entry[1:] for entry in sorted(self.heap, reverse=True)]
+
+class RuleMiner (object):
+    """
+    Association rules X => Y over the itemsets of a miner, read from one
+    hash of itemset -> decayed support.  The rules of an itemset grow
+    their consequents apriori-style: a rule whose confidence falls below
+    the minimum is dropped with every rule of a larger consequent, which
+    has a larger antecedent support and so a lower confidence.
+    A rule is (antecedent, consequent, support, confidence, lift), the
+    lift over the decayed count of every transaction read, None when the
+    consequent is not in the index.  The subsets of an itemset are looked
+    up in the index, so the itemsets must be mined in mode 'all', by a
+    miner giving each one once with its whole support: the vertical miner
+    or a canonical tree.
+    """
+    def __init__(self, supports, total, min_conf):
+        """
+        supports - frozenset of items -> decayed support
+        total - decayed count of the transactions
+        min_conf - minimum confidence of a rule
+        """
+        self.supports = supports
+        self.total = total
+        self.min_conf = min_conf
+        self.missing = 0 # rules skipped because their antecedent was not mined
+
+    @classmethod
+    def from_miner(cls, miner, threshold, min_conf, purge=True):
+        """
+        Mine the itemsets of a Tree or an EclatMiner at threshold into the
+        index of a new RuleMiner.  A tree without the canonical order gives
+        an itemset once per partition of its items, with a part of its
+        support each time, so it is refused.
+        """
+        if not isinstance(miner, EclatMiner) and not miner.canonical:
+            raise ValueError("rules need the itemset supports of a canonical tree or of the vertical miner")
+        supports = {}
+        miner.mine_to(lambda pattern, support: supports.__setitem__(frozenset(pattern), support), threshold, purge)
+        return cls(supports, miner.decayed_transactions(), min_conf)
+
+    def groups(self):
+        """
+        The itemsets of two items or more, grouped by their least item.
+        The rules of a group only read the index, so the groups are mined
+        independently; the largest come first to balance the workers.
+        """
+        groups = {}
+        for itemset in self.supports:
+            if len(itemset) > 1:
+                groups.setdefault(min(itemset), []).append(itemset)
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def itemset_rules(self, itemset, emit, floor=None):
+        """
+        Pass the rules of an itemset to emit.
+        floor - callable giving a confidence above the minimum under which
+        no rule is wanted, read again as the rules are emitted
+        """
+        supports = self.supports
+        support = supports[itemset]
+        items = sorted(itemset)
+        consequents = [(x,) for x in items]
+        while len(consequents) and len(consequents[0]) < len(items):
+            kept = []
+            for consequent in consequents:
+                base = supports.get(itemset.difference(consequent))
+                if base is None:
+                    self.missing += 1
+                    continue
+                confidence = support / base
+                if confidence < self.min_conf or (floor is not None and confidence < floor()):
+                    continue
+                kept.append(consequent)
+                other = supports.get(frozenset(consequent))
+                lift = confidence * self.total / other if other else None
+                emit((tuple(sorted(itemset.difference(consequent))), consequent, support, confidence, lift))
+            consequents = grow_consequents(kept)
+
+    def mine_to(self, emit, itemsets=None, floor=None):
+        """
+        Pass the rules of the itemsets, every mined one by default, to emit.
+        """
+        if itemsets is None:
+            itemsets = [x for x in self.supports if len(x) > 1]
+        for itemset in itemsets:
+            self.itemset_rules(itemset, emit, floor)
+        return emit
+
+    def rules(self):
+        """
+        Every rule reaching the minimum confidence.
+        """
+        rules = []
+        self.mine_to(rules.append)
+        return rules
+
+    def top_rules(self, k, key='lift', workers=0):
+        """
+        The k rules of highest lift or confidence, best first, in the
+        memory of k rules.  With workers the groups of itemsets are mined
+        by forked processes sharing the index, each one keeping its own k
+        best rules, which are merged at the end.
+        """
+        global sharedRules
+        collector = ruleCollector(k, key)
+        groups = self.groups()
+        try:
+            context = multiprocessing.get_context('fork') if workers else None
+        except ValueError:
+            # no fork on this platform, mine sequentially
+            context = None
+        if context is None:
+            for group in groups:
+                self.mine_to(collector.emit, group, lambda: collector.floor)
+            return collector.result()
+        chunksize = max(1, len(groups) // (workers * 8))
+        sharedRules = (self, groups)
+        gc.freeze()
+        try:
+            with context.Pool(workers) as pool:
+                tasks = ((index, k, key) for index in range(len(groups)))
+                for entries, missing in pool.imap_unordered(top_shared_group, tasks, chunksize):
+                    collector.merge(entries)
+                    self.missing += missing
+        finally:
+            gc.unfreeze()
+            sharedRules = None
+        return collector.result()
+
+class ruleCounter (object):
+    """
+    Rule sink keeping only the number of rules.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, rule):
+        self.count += 1
+
+def grow_consequents(consequents):
+    """
+    Join the sorted consequents of m items sharing their first m - 1 into
+    the consequents of m + 1 items whose every m-subset was kept.
+    """
+    kept = set(consequents)
+    grown = []
+    for i, first in enumerate(consequents):
+        for second in consequents[i + 1:]:
+            if first[:-1] != second[:-1]:
+                break
+            candidate = first + second[-1:]
+            if all(candidate[:j] + candidate[j + 1:] in kept for j in range(len(candidate) - 2)):
+                grown.append(candidate)
+    grown.sort()
+    return grown
+
+# rule miner and groups of itemsets inherited by the forked workers
+sharedRules = None
+
+def top_shared_group(task):
+    """
+    Keep the k best rules of one group of the RuleMiner inherited from
+    the parent process.
+    """
+    index, k, key = task
+    miner, groups = sharedRules
+    collector = ruleCollector(k, key)
+    missing = miner.missing
+    miner.mine_to(collector.emit, groups[index], lambda: collector.floor)
+    return collector.heap, miner.missing - missing
+
+def format_rule(rule):
+    antecedent, consequent, support, confidence, lift = rule
+    return "{} => {} support {:.4f} confidence {:.4f} lift {}".format(
+        ' '.join(map(str, antecedent)), ' '.join(map(str, consequent)), support, confidence,
+        'n/a' if lift is None else '{:.4f}'.format(lift))
+
+def main(argv):
+    database = ''
+    preMinSup = 0
+    minSup = 0
+    sampleSize = 0
+    batchSize = 1
+    minConf = None
+    topRules = 20
+    key = 'lift'
+    workers = 0
+    rerank = 10
+    lazy = False
+    fmt = 'auto'
+    useMmap = False
+    vertical = None
+    try:
+        opts, args = getopt.getopt(argv, "hd:p:m:s:b:r:k:y:w:c:lf:Mv:")
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    if not {'-d', '-p', '-m', '-s', '-b', '-r'} <= {opt for opt, arg in opts}:
+        print("Please provide all parameters needed.")
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE)
+            sys.exit()
+        elif opt == '-d':
+            database = arg
+        elif opt == '-p':
+            preMinSup = float(arg)
+        elif opt == '-m':
+            minSup = float(arg)
+        elif opt == '-s':
+            sampleSize = int(arg)
+        elif opt == '-b':
+            batchSize = int(arg)
+        elif opt == '-r':
+            minConf = float(arg)
+        elif opt == '-k':
+            topRules = int(arg)
+        elif opt == '-y':
+            key = arg
+        elif opt == '-w':
+            workers = int(arg) or os.cpu_count()
+        elif opt == '-c':
+            rerank = int(arg)
+        elif opt == '-l':
+            lazy = True
+        elif opt == '-f':
+            fmt = arg
+        elif opt == '-M':
+            useMmap = True
+        elif opt == '-v':
+            vertical = float(arg)
+
+    if vertical is not None:
+        miner = EclatMiner(0.6, vertical)
+    else:
+        # canonical, the rules need the whole support of every itemset
+        miner = Tree([], 1, 0.6, 'None', 0, True, rerank, lazy)
+    start_time = time.time()
+    for batch in read_batches(database, batchSize, sampleSize, fmt, useMmap):
+        miner.insert_transactions(batch, preMinSup * batchSize)
+    print("{}--- {:.4f} seconds ---".format("Inserted the batches", time.time() - start_time))
+
+    start_time = time.time()
+    rules = RuleMiner.from_miner(miner, minSup * batchSize, minConf)
+    print("Indexed {} itemsets --- {:.4f} seconds ---".format(len(rules.supports), time.time() - start_time))
+    start_time = time.time()
+    count = rules.mine_to(ruleCounter()).count
+    print("Rules - {} (minConf {}) --- {:.4f} seconds ---".format(count, minConf, time.time() - start_time))
+    if rules.missing:
+        print("Skipped {} rules whose antecedent was not mined".format(rules.missing))
+    start_time = time.time()
+    top = rules.top_rules(topRules, key, workers)
+    print("Top {} rules by {} --- {:.4f} seconds ---".format(topRules, key, time.time() - start_time))
+    for rule in top:
+        print(format_rule(rule))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,332 @@
+import sys
+import os
+import stat
+import json
+import time
+import getopt
+import asyncio
+import tempfile
+import concurrent.futures
+
+from handler import Tree, treeView, write_snapshot, read_transactions
+
+USAGE = ("service.py -b <batchSize> -p <preMinSup> [-W <window>] [-q <queueSize>] [-a <host:port>] [-u <socket>] [-c <rerank>] [-l]\n"
+         "service.py client (-a <host:port> | -u <socket>) [-d <database>] [command ...]")
+
+class StreamService (object):
+    """
+    Feed a tree with the transactions read from line streams.  Readers put
+    the transactions in a bounded queue, so a full queue stops the reading
+    of the sockets; a batcher groups them by count or by time window and
+    inserts every batch on a single-thread executor.  The queries are
+    answered between two batches, so they never see one half done; the
+    mining ones only flatten the tree there, and mine a snapshot of it on
+    another thread while the batches go on.  The two threads share the
+    interpreter lock, so a long mining slows the insertion down without
+    stopping it.  The tree must be canonical for the mining to be exact.
+    Lines starting with '!' are commands, answered with a JSON line:
+    !support <item> ... [; <item> ...]   decayed support of itemsets
+    !mine <minSup> [mode] [limit]   itemsets, mode 'all', 'closed' or 'maximal'
+    !topk <k>                the k itemsets of highest support
+    !stats                   counters of the service and of the tree
+    !flush                   insert the transactions read so far, then answer
+    The supports are fractions of the batch size, as in handler.py.
+    """
+    def __init__(self, tree, batchSize, preMinSup, window=0, queueSize=10000):
+        self.tree = tree
+        self.batchSize = batchSize
+        self.threshold = preMinSup * batchSize
+        self.window = window
+        self.queue = asyncio.Queue(queueSize)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.miner = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.transactions = 0
+        self.queries = 0
+        self.insert_seconds = 0
+
+    async def batcher(self):
+        """
+        Group the queued transactions into batches: a batch is inserted
+        when it is full, when window seconds went by since its first
+        transaction, or when a flush reaches it.  None stops the batcher.
+        """
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - loop.time())
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self.insert(batch)
+                batch = []
+                deadline = None
+                continue
+            if item is None or isinstance(item, asyncio.Future):
+                if len(batch):
+                    await self.insert(batch)
+                    batch = []
+                    deadline = None
+                if item is None:
+                    return
+                item.set_result(self.transactions)
+                continue
+            batch.append(item)
+            if deadline is None and self.window:
+                deadline = loop.time() + self.window
+            if len(batch) >= self.batchSize:
+                await self.insert(batch)
+                batch = []
+                deadline = None
+
+    async def insert(self, batch):
+        start = time.time()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.tree.insert_transactions, batch, self.threshold)
+        self.insert_seconds += time.time() - start
+        self.batches += 1
+        self.transactions += len(batch)
+
+    async def read(self, reader, writer):
+        """
+        Queue the transactions of a stream and answer its commands, until
+        it ends.  The answers go to writer, a StreamWriter or a file.  The
+        commands of a stream run one after the other, in order, while its
+        next transactions are read, so a query sees at least what the
+        stream sent before the last '!flush' ahead of it.
+        """
+        pending = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode().strip()
+            if not line:
+                continue
+            if line.startswith('!'):
+                fields = line[1:].split()
+                done = None
+                if fields[:1] == ['flush']:
+                    # queued now, behind the transactions read before it
+                    done = asyncio.get_running_loop().create_future()
+                    await self.queue.put(done)
+                pending = asyncio.ensure_future(self.answer(fields, writer, pending, done))
+            else:
+                await self.queue.put(line.split())
+        if pending is not None:
+            await pending
+
+    async def answer(self, fields, writer, previous, done=None):
+        if previous is not None:
+            await previous
+        await self.write(writer, json.dumps(await self.command(fields, done)))
+
+    async def write(self, writer, text):
+        if isinstance(writer, asyncio.StreamWriter):
+            writer.write(text.encode() + b'\n')
+            await writer.drain()
+        else:
+            writer.write(text + '\n')
+            writer.flush()
+
+    async def command(self, fields, done=None):
+        """
+        Answer a command; done is the flush marker when it is already queued.
+        """
+        self.queries += 1
+        if not len(fields):
+            return {'error': 'empty command'}
+        if fields[0] == 'flush':
+            if done is None:
+                done = asyncio.get_running_loop().create_future()
+                await self.queue.put(done)
+            return {'transactions': await done}
+        loop = asyncio.get_running_loop()
+        try:
+            if fields[0] in ('mine', 'topk'):
+                sections, settings = await loop.run_in_executor(self.executor, self.tree.snapshot)
+                return await loop.run_in_executor(self.miner, self.mine_snapshot, sections, settings, fields[0], fields[1:])
+            return await loop.run_in_executor(self.executor, self.query, fields[0], fields[1:])
+        except (ValueError, IndexError, KeyError) as error:
+            return {'error': '{}: {}'.format(type(error).__name__, error)}
+
+    def mine_snapshot(self, sections, settings, name, args):
+        """
+        Answer a mining command over a view of a snapshot of the tree, on
+        the mining thread.
+        """
+        handle, path = tempfile.mkstemp(suffix='.tfts')
+        os.close(handle)
+        try:
+            write_snapshot(path, sections, settings)
+            view = treeView(path)
+            try:
+                return self.query(name, args, view)
+            finally:
+                view.close()
+        finally:
+            os.remove(path)
+
+    def query(self, name, args, tree=None):
+        """
+        Answer a command on the executor, between two batches, or over
+        tree, a view of the tree, for the mining ones.
+        """
+        if tree is None:
+            tree = self.tree
+        if name == 'support':
+            itemsets = [x.split() for x in ' '.join(args).split(';')]
+            supports = tree.supports(itemsets)
+            if len(itemsets) == 1:
+                return {'itemset': itemsets[0], 'support': supports[0]}
+            return {'supports': [[itemset, support] for itemset, support in zip(itemsets, supports)]}
+        if name == 'mine':
+            threshold = float(args[0]) * self.batchSize
+            mode = args[1] if len(args) > 1 else 'all'
+            limit = int(args[2]) if len(args) > 2 else 100
+            records = []
+            tree.mine_to(lambda pattern, support: records.append((support, pattern)), threshold, True, mode)
+            records.sort(reverse=True)
+            return {'count': len(records), 'itemsets': [[list(pattern), support] for support, pattern in records[:limit]]}
+        if name == 'topk':
+            return {'itemsets': [[list(pattern), support] for pattern, support in tree.mine_topk(int(args[0]))]}
+        if name == 'stats':
+            result = {'batches': self.batches, 'transactions': self.transactions, 'queries': self.queries,
+                      'queued': self.queue.qsize(), 'insert_seconds': self.insert_seconds, 'nodes': tree.nodes}
+            if tree.stats is not None:
+                result['tree'] = tree.stats.snapshot()
+            return result
+        return {'error': 'unknown command {}'.format(name)}
+
+class fileReader (object):
+    """
+    readline of a regular file, run on the default executor so the loop
+    goes on while the file is read.
+    """
+    def __init__(self, source):
+        self.source = source
+
+    async def readline(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.source.readline)
+
+async def serve(service, address, unix):
+    """
+    Run the batcher and read from the sockets, or from stdin when none is
+    given, answering on stdout.
+    """
+    loop = asyncio.get_running_loop()
+    batcher = asyncio.create_task(service.batcher())
+    servers = []
+    if address:
+        host, port = address.rsplit(':', 1)
+        servers.append(await asyncio.start_server(service.read, host, int(port)))
+    if unix:
+        servers.append(await asyncio.start_unix_server(service.read, unix))
+    if len(servers):
+        for server in servers:
+            print("Listening on {}".format(', '.join(str(x.getsockname()) for x in server.sockets)), file=sys.stderr)
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    else:
+        if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+            # no pipe transport over a regular file
+            reader = fileReader(sys.stdin.buffer)
+        else:
+            reader = asyncio.StreamReader()
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        await service.read(reader, sys.stdout)
+    await service.queue.put(None)
+    await batcher
+
+async def client(address, unix, database, commands):
+    """
+    Local test client: send the transactions of a database, one per line,
+    then the commands, and print their answers.
+    """
+    if unix:
+        reader, writer = await asyncio.open_unix_connection(unix)
+    else:
+        host, port = address.rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+    answers = asyncio.create_task(read_answers(reader, len(commands)))
+    if database:
+        for transaction in read_transactions(database):
+            writer.write(' '.join(transaction).encode() + b'\n')
+            await writer.drain()
+    for command in commands:
+        writer.write(command.encode() + b'\n')
+        await writer.drain()
+    for answer in await answers:
+        print(answer)
+    writer.close()
+    await writer.wait_closed()
+
+async def read_answers(reader, count):
+    answers = []
+    while len(answers) < count:
+        line = await reader.readline()
+        if not line:
+            break
+        answers.append(line.decode().strip())
+    return answers
+
+def main(argv):
+    if len(argv) and argv[0] == 'client':
+        try:
+            opts, args = getopt.getopt(argv[1:], "ha:u:d:")
+        except getopt.GetoptError:
+            print(USAGE)
+            sys.exit(2)
+        options = dict(opts)
+        if '-h' in options or not ('-a' in options or '-u' in options):
+            print(USAGE)
+            sys.exit(2)
+        asyncio.run(client(options.get('-a'), options.get('-u'), options.get('-d'), args))
+        return
+    batchSize = 0
+    preMinSup = 0
+    window = 0
+    queueSize = 10000
+    address = ''
+    unix = ''
+    rerank = 10
+    lazy = False
+    try:
+        opts, args = getopt.getopt(argv, "hb:p:W:q:a:u:c:l")
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE)
+            sys.exit()
+        elif opt == '-b':
+            batchSize = int(arg)
+        elif opt == '-p':
+            preMinSup = float(arg)
+        elif opt == '-W':
+            window = float(arg)
+        elif opt == '-q':
+            queueSize = int(arg)
+        elif opt == '-a':
+            address = arg
+        elif opt == '-u':
+            unix = arg
+        elif opt == '-c':
+            rerank = int(arg)
+        elif opt == '-l':
+            lazy = True
+    if batchSize <= 0:
+        print(USAGE)
+        sys.exit(2)
+
+    async def run():
+        # canonical, so the mining of every command is exact
+        tree = Tree([], 1, 0.6, 'None', 0, True, rerank, lazy)
+        await serve(StreamService(tree, batchSize, preMinSup, window, queueSize), address, unix)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
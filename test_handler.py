@@ -0,0 +1,325 @@
+import os
+import random
+import tempfile
+import unittest
+import itertools
+
+from handler import Tree, treeView, EclatMiner, ItemDictionary, read_transactions, read_batches, convert_dataset
+from rules import RuleMiner
+
+FADING = 0.6
+
+def random_stream(seed, batches=15, size=20, items='abcdefgh'):
+    generator = random.Random(seed)
+    return [[generator.sample(items, generator.randint(1, 5)) for _ in range(size)] for _ in range(batches)]
+
+def brute_force(stream):
+    """
+    Decayed support at the last batch of every itemset of the stream.
+    """
+    supports = {}
+    for index, batch in enumerate(stream):
+        weight = pow(FADING, len(stream) - 1 - index)
+        for transaction in batch:
+            for length in range(1, len(transaction) + 1):
+                for itemset in itertools.combinations(sorted(transaction), length):
+                    supports[itemset] = supports.get(itemset, 0) + weight
+    return supports
+
+class decayedSupportTest (unittest.TestCase):
+    """
+    The mining of the tree against a brute-force count of the decayed
+    supports, eager and lazy, with and without the canonical order.
+    """
+    threshold = 2.0
+
+    def build(self, canonical, lazy, stream):
+        tree = Tree([], 1, FADING, 'None', 0, canonical, 5, lazy)
+        for batch in stream:
+            tree.insert_transactions(batch, 0)
+        return tree
+
+    def assertSupports(self, expected, actual):
+        self.assertEqual(set(expected), set(actual))
+        for itemset, support in expected.items():
+            self.assertAlmostEqual(actual[itemset], support, delta=support * 1e-9)
+
+    def test_mining(self):
+        for seed, canonical, lazy in itertools.product(range(3), (False, True), (False, True)):
+            with self.subTest(seed=seed, canonical=canonical, lazy=lazy):
+                stream = random_stream(seed)
+                tree = self.build(canonical, lazy, stream)
+                # without the canonical order an itemset is mined once per partition
+                mined = {}
+                def sink(pattern, support):
+                    key = tuple(sorted(pattern))
+                    mined[key] = mined.get(key, 0) + support
+                tree.mine_to(sink, 0, False)
+                frequent = {key: value for key, value in mined.items() if value >= self.threshold}
+                expected = {key: value for key, value in brute_force(stream).items() if value >= self.threshold}
+                self.assertSupports(expected, frequent)
+
+    def test_lazy_threshold(self):
+        # supports of the last batch land exactly on an integer threshold
+        for seed in range(5):
+            stream = random_stream(seed, items='abcdefghij')
+            mined = []
+            for lazy in (False, True):
+                tree = self.build(True, lazy, stream)
+                for threshold in (1.0, 2.0, 3.0):
+                    itemsets = {}
+                    tree.mine_to(lambda pattern, support: itemsets.__setitem__(frozenset(pattern), support), threshold, False)
+                    mined.append(set(itemsets))
+            with self.subTest(seed=seed):
+                self.assertEqual(mined[:3], mined[3:])
+    def test_pruning_error(self):
+        for seed, lazy in itertools.product(range(3), (False, True)):
+            with self.subTest(seed=seed, lazy=lazy):
+                stream = random_stream(seed)
+                tree = Tree([], 1, FADING, 'None', 0, True, 5, lazy, 0.5, 1)
+                for batch in stream:
+                    tree.insert_transactions(batch, 0)
+                mined = {}
+                tree.mine_to(lambda pattern, support: mined.__setitem__(tuple(sorted(pattern)), support), 0, False)
+                self.assertGreater(tree.error, 0)
+                # pruning only underestimates, by at most the error it reports
+                for itemset, support in brute_force(stream).items():
+                    found = mined.get(itemset, 0)
+                    self.assertLessEqual(found, support + 1e-9)
+                    self.assertLessEqual(support - found, tree.error + 1e-9)
+
+    def test_merge(self):
+        for seed, lazy, epsilon in itertools.product(range(3), (False, True), (0, 0.5)):
+            with self.subTest(seed=seed, lazy=lazy, epsilon=epsilon):
+                stream = random_stream(seed)
+                first, second = [Tree([], 1, FADING, 'None', 0, True, 5, lazy, epsilon, 1) for _ in range(2)]
+                for batch in stream[:8]:
+                    first.insert_transactions(batch, 0)
+                for batch in stream[8:]:
+                    second.insert_transactions(batch, 0)
+                # a tree that prunes nothing takes the error of the other one as it is
+                unpruned = Tree([], 1, FADING, 'None', 0, True, 5, lazy)
+                for batch in stream[:8]:
+                    unpruned.insert_transactions(batch, 0)
+                unpruned.merge(second)
+                self.assertAlmostEqual(unpruned.error, second.error, delta=1e-12)
+                first.merge(second)
+                mined = {}
+                first.mine_to(lambda pattern, support: mined.__setitem__(tuple(sorted(pattern)), support), 0, False)
+                expected = brute_force(stream)
+                if not epsilon:
+                    self.assertSupports(expected, mined)
+                    continue
+                # the errors of both trees bound what their pruning removed
+                for itemset, support in expected.items():
+                    found = mined.get(itemset, 0)
+                    self.assertLessEqual(found, support + 1e-9)
+                    self.assertLessEqual(support - found, first.error + 1e-9)
+    def test_incremental(self):
+        for seed, lazy in itertools.product(range(3), (False, True)):
+            with self.subTest(seed=seed, lazy=lazy):
+                # the last batches leave the items f to h untouched, their itemsets come from the cache
+                stream = random_stream(seed, batches=8) + random_stream(seed, batches=7, items='abcde')
+                tree = Tree([], 1, FADING, 'None', 0, True, 5, lazy)
+                for index, batch in enumerate(stream):
+                    tree.insert_transactions(batch, 0)
+                    if index % 3:
+                        continue
+                    incremental = {}
+                    for frequent in tree.mine_incremental(self.threshold, False):
+                        incremental.update((tuple(sorted(key)), value) for key, value in frequent.items())
+                    mined = {}
+                    tree.mine_to(lambda pattern, support: mined.__setitem__(tuple(sorted(pattern)), support), self.threshold, False)
+                    self.assertSupports(mined, incremental)
+    def test_topk(self):
+        stream = random_stream(7)
+        expected = sorted(brute_force(stream).values(), reverse=True)[:15]
+        for lazy in (False, True):
+            top = self.build(True, lazy, stream).mine_topk(15)
+            self.assertEqual(len(top), len(expected))
+            for (pattern, support), value in zip(top, expected):
+                self.assertAlmostEqual(support, value, delta=value * 1e-9)
+        with self.assertRaises(ValueError):
+            self.build(False, False, stream).mine_topk(15)
+    def test_condensed(self):
+        for seed, lazy in itertools.product(range(3), (False, True)):
+            stream = random_stream(seed)
+            frequent = {frozenset(key): value for key, value in brute_force(stream).items() if value >= self.threshold}
+            closed = {key: value for key, value in frequent.items()
+                      if not any(key < other and abs(frequent[other] - value) <= value * 1e-9 for other in frequent)}
+            maximal = {key: value for key, value in frequent.items() if not any(key < other for other in frequent)}
+            tree = self.build(True, lazy, stream)
+            for mode, expected in (('closed', closed), ('maximal', maximal)):
+                with self.subTest(seed=seed, lazy=lazy, mode=mode):
+                    mined = {}
+                    tree.mine_to(lambda pattern, support: mined.__setitem__(frozenset(pattern), support), self.threshold, False, mode)
+                    self.assertSupports(expected, mined)
+        with self.assertRaises(ValueError):
+            self.build(False, False, stream).mine_to(lambda pattern, support: None, self.threshold, False, 'closed')
+    def test_thresholds(self):
+        thresholds = [1.0, 2.0, 3.0]
+        for seed, lazy in itertools.product(range(3), (False, True)):
+            with self.subTest(seed=seed, lazy=lazy):
+                stream = random_stream(seed)
+                expected = brute_force(stream)
+                result = self.build(True, lazy, stream).mine_itemsets_multi(thresholds, False)
+                for threshold in thresholds:
+                    frequent = {key: value for key, value in expected.items() if value >= threshold}
+                    self.assertEqual(result.count(threshold), len(frequent))
+                    self.assertSupports(frequent, {tuple(sorted(key)): value for key, value in result.itemsets(threshold)})
+        with self.assertRaises(ValueError):
+            self.build(False, False, stream).mine_itemsets_multi(thresholds, False)
+    def test_snapshot(self):
+        stream = random_stream(11)
+        expected = brute_force(stream)
+        itemsets = list(expected)
+        frequent = {key: value for key, value in expected.items() if value >= self.threshold}
+        for lazy in (False, True):
+            with self.subTest(lazy=lazy):
+                handle, path = tempfile.mkstemp(suffix='.tfts')
+                os.close(handle)
+                try:
+                    self.build(True, lazy, stream).save(path)
+                    loaded = Tree.load(path)
+                    self.assertSupports(expected, dict(zip(itemsets, loaded.supports(itemsets))))
+                    view = treeView(path)
+                    try:
+                        mined = {}
+                        view.mine_to(lambda pattern, support: mined.__setitem__(tuple(sorted(pattern)), support), self.threshold, False)
+                        self.assertSupports(frequent, mined)
+                        self.assertAlmostEqual(view.decayed_transactions(), loaded.decayed_transactions(), delta=1e-9)
+                        with self.assertRaises(ValueError):
+                            view.mine_incremental(self.threshold, False)
+                    finally:
+                        view.close()
+                finally:
+                    os.remove(path)
+    def test_vertical(self):
+        for seed, weight in itertools.product(range(3), (0, 0.05)):
+            with self.subTest(seed=seed, weight=weight):
+                stream = random_stream(seed)
+                vertical = EclatMiner(FADING, weight)
+                for batch in stream:
+                    vertical.insert_transactions(batch, 0)
+                mined = {}
+                vertical.mine_to(lambda pattern, support: mined.__setitem__(tuple(sorted(pattern)), support), self.threshold, False)
+                expected = brute_force(stream)
+                if not weight:
+                    tree = {}
+                    self.build(True, False, stream).mine_to(lambda pattern, support: tree.__setitem__(tuple(sorted(pattern)), support), self.threshold, False)
+                    self.assertSupports(tree, mined)
+                    self.assertSupports({key: value for key, value in expected.items() if value >= self.threshold}, mined)
+                    continue
+                # the dropped batches only underestimate, by at most the error
+                self.assertGreater(vertical.error, 0)
+                for itemset, support in expected.items():
+                    found = mined.get(itemset, 0)
+                    self.assertLessEqual(found, support + 1e-9)
+                    if support >= self.threshold + vertical.error:
+                        self.assertGreaterEqual(found, support - vertical.error - 1e-9)
+    def test_supports(self):
+        for seed, canonical, lazy in itertools.product(range(3), (False, True), (False, True)):
+            with self.subTest(seed=seed, canonical=canonical, lazy=lazy):
+                stream = random_stream(seed)
+                expected = brute_force(stream)
+                tree = self.build(canonical, lazy, stream)
+                itemsets = list(expected)
+                self.assertSupports(expected, dict(zip(itemsets, tree.supports(itemsets))))
+                handle, path = tempfile.mkstemp(suffix='.tfts')
+                os.close(handle)
+                try:
+                    tree.save(path)
+                    view = treeView(path)
+                    try:
+                        self.assertSupports(expected, {itemset: view.support(itemset) for itemset in itemsets})
+                    finally:
+                        view.close()
+                finally:
+                    os.remove(path)
+    def test_windows(self):
+        for seed, canonical in itertools.product(range(3), (False, True)):
+            with self.subTest(seed=seed, canonical=canonical):
+                stream = random_stream(seed)
+                tree = Tree([], 1, FADING, 'None', 0, canonical, 5, False, window=8)
+                for batch in stream:
+                    tree.insert_transactions(batch, 0)
+                # the newest buckets hold single batches, so short horizons are exact
+                for horizon in (1, 2):
+                    expected = brute_force([[]] * (len(stream) - horizon) + [[x for batch in stream[-horizon:] for x in batch]])
+                    itemsets = list(expected)
+                    self.assertSupports(expected, dict(zip(itemsets, tree.supports(itemsets, horizon))))
+                # O(log window) buckets of three fields each
+                self.assertTrue(all(len(window) // 3 <= 2 * (8).bit_length() for window in tree.windows.values()))
+                self.assertEqual(len(tree.windows), tree.nodes)
+                with self.assertRaises(ValueError):
+                    tree.mine_to(lambda pattern, support: None, 1, False, horizon=9)
+        # the windows of the pruned nodes go with them
+        tree = Tree([], 1, FADING, 'None', 0, False, 5, False, 0.5, 1, window=8)
+        for batch in stream:
+            tree.insert_transactions(batch, 0)
+        self.assertGreater(tree.error, 0)
+        self.assertEqual(len(tree.windows), tree.nodes)
+    def test_rules(self):
+        stream = random_stream(3)
+        with self.assertRaises(ValueError):
+            RuleMiner.from_miner(self.build(False, False, stream), 1.0, 0.3)
+        expected = brute_force(stream)
+        total = sum(pow(FADING, len(stream) - 1 - index) * len(batch) for index, batch in enumerate(stream))
+        for lazy in (False, True):
+            with self.subTest(lazy=lazy):
+                miner = RuleMiner.from_miner(self.build(True, lazy, stream), 1.0, 0.3)
+                rules = miner.rules()
+                self.assertTrue(len(rules))
+                self.assertEqual(miner.missing, 0)
+                for antecedent, consequent, support, confidence, lift in rules:
+                    value = expected[tuple(sorted(antecedent + consequent))] / expected[tuple(sorted(antecedent))]
+                    self.assertAlmostEqual(confidence, value, delta=1e-9)
+                    self.assertAlmostEqual(lift, value * total / expected[tuple(sorted(consequent))], delta=1e-9)
+                top = miner.top_rules(5, 'confidence')
+                self.assertEqual([x[3] for x in top], sorted([x[3] for x in rules], reverse=True)[:5])
+
+class readerTest (unittest.TestCase):
+    """
+    The text readers: the format guessed from the first lines and the
+    batches streamed from the file.
+    """
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, lines):
+        with open(self.path, 'w') as output:
+            output.write('\n'.join(lines) + '\n')
+
+    def test_quest(self):
+        self.write(['1 2 7 3 5', '1 1 8 4', '2 3 9 1 2 6'])
+        self.assertEqual(list(read_transactions(self.path)), [['3', '5'], ['4'], ['1', '2', '6']])
+
+    def test_numeric_basket(self):
+        # the first line looks like a quest one, the second does not
+        self.write(['1 2 7 3 5', '4 6 8', '', '2 9'])
+        self.assertEqual(list(read_transactions(self.path)), [['1', '2', '7', '3', '5'], ['4', '6', '8'], ['2', '9']])
+
+    def test_batches(self):
+        self.write(['a b', 'c', 'a c', 'b', 'd'])
+        self.assertEqual(list(read_batches(self.path, 2)), [[['a', 'b'], ['c']], [['a', 'c'], ['b']], [['d']]])
+        self.assertEqual(list(read_batches(self.path, 2, 3, use_mmap=True)), [[['a', 'b'], ['c']], [['a', 'c']]])
+    def test_binary(self):
+        self.write(['b a', 'c', 'a c d'])
+        target = self.path + '.bin'
+        try:
+            items = convert_dataset(self.path, target)
+            self.assertEqual(list(read_transactions(target)), [['b', 'a'], ['c'], ['a', 'c', 'd']])
+            # read with a dictionary the ids are those of the dictionary
+            again = ItemDictionary()
+            transactions = list(read_transactions(target, 2, items=again))
+            self.assertEqual([[again.decode(x) for x in transaction] for transaction in transactions], [['b', 'a'], ['c']])
+            self.assertEqual(items.labels, ['b', 'a', 'c', 'd'])
+        finally:
+            os.remove(target)
+
+if __name__ == "__main__":
+    unittest.main()